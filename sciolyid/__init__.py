@@ -49,6 +49,17 @@ def setup(*args, **kwargs):
             except KeyError as e:
                 raise config.BotConfigError(f"Required web setup argument {option}") from e
 
+    if (
+        config.options["daily_retention_days"] is not None
+        and config.options["daily_retention_days"] < 30
+    ):
+        raise config.BotConfigError("daily_retention_days must be at least 30")
+
+    if config.options["backup_chunk_size"] >= config.options["backup_upload_limit"]:
+        raise config.BotConfigError(
+            "backup_chunk_size must be less than backup_upload_limit"
+        )
+
     if config.options["category_name"]:
         config.options["id_groups"] = True
         config.options["category_name"] = config.options["category_name"].title()
@@ -63,6 +74,7 @@ def setup(*args, **kwargs):
         "download_dir",
         "group_dir",
         "log_dir",
+        "media_cache_dir",
         "state_dir",
         "tmp_upload_dir",
         "validation_local_dir",
@@ -74,8 +86,10 @@ def setup(*args, **kwargs):
 
     bot_files_subdirs = (
         "backups_dir",
+        "data_cache_file",
         "download_dir",
         "log_dir",
+        "media_cache_dir",
         "tmp_upload_dir",
         "validation_local_dir",
     )
@@ -0,0 +1,220 @@
+# backups.py | database backup archive format
+# Copyright (C) 2019-2021  EraserBird, person_v1.32, hmmm
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import gzip
+import hashlib
+import json
+import os
+from struct import Struct
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# A backup archive is a directory with gzipped chunks of records and an index.
+#
+# Each record in a chunk is a header (key length, ttl in milliseconds or -1,
+# value length) followed by the key and the value from Redis DUMP.
+#
+# index.json = {
+#   version: archive format version
+#   name: archive name (directory name)
+#   mode: "full" or "incremental"
+#   base: name of the previous archive for incremental archives, otherwise None
+#   created: unix timestamp
+#   keys: total number of records
+#   chunks: [{file: filename, keys: # of records, size: bytes, sha256: checksum}]
+#   deleted: [keys deleted since the base archive]
+# }
+#
+# Restoring an incremental archive requires restoring its base first.
+#
+# Files larger than the upload limit are split into parts named
+# <file>.partNNN before uploading. The parts are joined again when the
+# chunk is read, and the checksum is of the joined file.
+
+ARCHIVE_VERSION = 1
+INDEX_FILE = "index.json"
+
+_record_header = Struct(">IqI")
+
+Record = Tuple[bytes, int, bytes]  # key, ttl, value
+
+
+def _checksum(path: str) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 16), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class ArchiveWriter:
+    """Writes records to a new backup archive.
+
+    A new chunk is started before a record that could take the current
+    chunk past `chunk_size` bytes. A single record larger than that gets
+    a chunk of its own, which is split into parts when it's uploaded.
+    Methods are blocking, so they should be run in an executor from
+    async code.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mode: str,
+        created: int,
+        chunk_size: int,
+        base: Optional[str] = None,
+    ):
+        os.makedirs(path)
+        self.path = path
+        self.index = {
+            "version": ARCHIVE_VERSION,
+            "name": os.path.basename(path.rstrip("/")),
+            "mode": mode,
+            "base": base,
+            "created": created,
+            "keys": 0,
+            "chunks": [],
+            "deleted": [],
+        }
+        self.chunk_size = chunk_size
+        self._raw = None
+        self._file = None
+        self._count = 0
+
+    def _open_chunk(self):
+        filename = f"chunk-{len(self.index['chunks']):04d}.gz"
+        self._raw = open(os.path.join(self.path, filename), "wb")
+        self._file = gzip.GzipFile(filename=filename, fileobj=self._raw, mode="wb")
+        self._count = 0
+
+    def _close_chunk(self):
+        self._file.close()
+        self._raw.close()
+        path = self._raw.name
+        self.index["chunks"].append(
+            {
+                "file": os.path.basename(path),
+                "keys": self._count,
+                "size": os.path.getsize(path),
+                "sha256": _checksum(path),
+            }
+        )
+        self.index["keys"] += self._count
+        self._raw = self._file = None
+
+    def write(self, records: Iterable[Record]):
+        """Appends records to the archive."""
+        for key, ttl, value in records:
+            # the compressed size isn't known before writing, so assume
+            # the record doesn't compress
+            record_size = _record_header.size + len(key) + len(value)
+            if (
+                self._file is not None
+                and self._count
+                and self._raw.tell() + record_size > self.chunk_size
+            ):
+                self._close_chunk()
+            if self._file is None:
+                self._open_chunk()
+            self._file.write(_record_header.pack(len(key), ttl, len(value)))
+            self._file.write(key)
+            self._file.write(value)
+            self._count += 1
+            if self._raw.tell() >= self.chunk_size:
+                self._close_chunk()
+
+    def close(self, deleted: Iterable[bytes] = ()) -> dict:
+        """Finishes the archive and writes the index.
+
+        `deleted` - keys that were deleted since the base archive
+        """
+        if self._file is not None:
+            self._close_chunk()
+        self.index["deleted"] = sorted(
+            key.decode("utf-8", "surrogateescape") for key in deleted
+        )
+        with open(os.path.join(self.path, INDEX_FILE), "w") as f:
+            json.dump(self.index, f, indent=1)
+        return self.index
+
+
+def read_index(path: str) -> dict:
+    """Reads the index of the archive at `path`."""
+    with open(os.path.join(path, INDEX_FILE), "r") as f:
+        index = json.load(f)
+    if index.get("version") != ARCHIVE_VERSION:
+        raise ValueError(f"Unsupported backup archive version in {path}")
+    return index
+
+
+def _part_name(filename: str, part: int) -> str:
+    return f"{filename}.part{part:03d}"
+
+
+def split_large_files(path: str, max_size: int) -> List[str]:
+    """Splits files in the archive at `path` that are larger than `max_size`.
+
+    Each large file is replaced by parts of at most `max_size` bytes.
+    Returns the filenames in the archive afterwards.
+    """
+    for filename in os.listdir(path):
+        file_path = os.path.join(path, filename)
+        if os.path.getsize(file_path) <= max_size:
+            continue
+        with open(file_path, "rb") as f:
+            for part, data in enumerate(iter(lambda: f.read(max_size), b"")):
+                with open(os.path.join(path, _part_name(filename, part)), "wb") as p:
+                    p.write(data)
+        os.remove(file_path)
+    return sorted(os.listdir(path))
+
+
+def _join_parts(file_path: str):
+    """Joins the parts of a split file if the file doesn't exist."""
+    if os.path.exists(file_path) or not os.path.exists(_part_name(file_path, 0)):
+        return
+    with open(file_path + ".tmp", "wb") as f:
+        part = 0
+        while os.path.exists(_part_name(file_path, part)):
+            with open(_part_name(file_path, part), "rb") as p:
+                for block in iter(lambda: p.read(1 << 16), b""):
+                    f.write(block)
+            part += 1
+    os.replace(file_path + ".tmp", file_path)
+
+
+def read_chunk(path: str, chunk: dict) -> Iterator[Record]:
+    """Reads records from a chunk of the archive at `path`.
+
+    A chunk that was split into parts is joined first. The checksum is
+    verified before any records are read.
+    """
+    chunk_path = os.path.join(path, chunk["file"])
+    _join_parts(chunk_path)
+    if _checksum(chunk_path) != chunk["sha256"]:
+        raise ValueError(f"Checksum mismatch for {chunk_path}")
+    with gzip.open(chunk_path, "rb") as f:
+        while True:
+            header = f.read(_record_header.size)
+            if not header:
+                return
+            key_length, ttl, value_length = _record_header.unpack(header)
+            yield f.read(key_length), ttl, f.read(value_length)
+
+
+def deleted_keys(index: dict) -> Iterator[bytes]:
+    """Returns the deleted keys listed in an archive index."""
+    return (key.encode("utf-8", "surrogateescape") for key in index["deleted"])
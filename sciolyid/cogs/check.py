@@ -15,7 +15,6 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import string
-from difflib import get_close_matches
 
 import discord
 import discord.ext.commands.view
@@ -27,7 +26,7 @@ from sciolyid.data import (
     get_aliases,
     format_wiki_url,
     logger,
-    possible_words,
+    possible_words_index,
     prompts,
 )
 from sciolyid.data_functions import (
@@ -56,9 +55,16 @@ class Check(commands.Cog):
     async def check(self, ctx: commands.Context, *, arg: str):
         logger.info("command: check")
 
-        current_item = database.hget(f"channel:{ctx.channel.id}", "item").decode(
-            "utf-8"
+        pipe = database.pipeline()
+        pipe.hget(f"channel:{ctx.channel.id}", "item")
+        pipe.exists(f"race.data:{ctx.channel.id}")
+        pipe.hget(f"race.data:{ctx.channel.id}", "strict")
+        pipe.hget(f"session.data:{ctx.author.id}", "strict")
+        current_item, race_in_session, race_strict, session_strict = (
+            await pipe.execute()
         )
+
+        current_item = current_item.decode("utf-8")
         if current_item == "":  # no image
             await ctx.send("You must ask for a image first!")
             return
@@ -69,63 +75,63 @@ class Check(commands.Cog):
         logger.info("current_item: " + current_item)
         logger.info("arg: " + arg)
 
-        item_setup(ctx, current_item)
         correct_list = (x.lower() for x in get_aliases(current_item))
 
-        if database.exists(f"race.data:{ctx.channel.id}"):
+        if race_in_session:
             logger.info("race in session")
-            if database.hget(f"race.data:{ctx.channel.id}", "strict"):
-                logger.info("strict spelling")
-                correct = arg in correct_list
-            else:
-                logger.info("spelling leniency")
-                correct = better_spellcheck(arg, correct_list, possible_words)
+            strict = race_strict
         else:
             logger.info("no race")
-            if database.hget(f"session.data:{ctx.author.id}", "strict"):
-                logger.info("strict spelling")
-                correct = arg in correct_list
-            else:
-                logger.info("spelling leniency")
-                correct = better_spellcheck(arg, correct_list, possible_words)
+            strict = session_strict
+
+        if strict:
+            logger.info("strict spelling")
+            correct = arg in correct_list
+        else:
+            logger.info("spelling leniency")
+            correct = better_spellcheck(arg, correct_list, possible_words_index)
+
+        pipe = database.pipeline()
+        await item_setup(ctx, current_item, pipe)
 
         if correct:
             logger.info("correct")
 
-            database.hset(f"channel:{ctx.channel.id}", "item", "")
-            database.hset(f"channel:{ctx.channel.id}", "answered", "1")
-
-            session_increment(ctx, "correct", 1)
-            streak_increment(ctx, 1)
-            database.zincrby(
+            pipe.hset(
+                f"channel:{ctx.channel.id}", mapping={"item": "", "answered": "1"}
+            )
+            await session_increment(ctx, "correct", 1, pipe)
+            await streak_increment(ctx, 1, pipe)
+            pipe.zincrby(
                 f"correct.user:{ctx.author.id}",
                 1,
                 string.capwords(str(current_item)),
             )
+            await score_increment(ctx, 1, pipe)
+            if race_in_session:
+                pipe.hmget(
+                    f"race.data:{ctx.channel.id}", ["limit", "group", "state", "bw"]
+                )
+                pipe.zrevrange(f"race.scores:{ctx.channel.id}", 0, 0, True)
+                race_data, first = (await pipe.execute())[-2:]
+            else:
+                await pipe.execute()
 
             await ctx.send(
                 f"Correct! Good job! The image was **{current_item}**."
-                if not database.exists(f"race.data:{ctx.channel.id}")
+                if not race_in_session
                 else f"**{ctx.author.mention}**, you are correct! The image was **{current_item}**."
             )
-            url = format_wiki_url(ctx, current_item)
+            url = await format_wiki_url(ctx, current_item)
             await ctx.send(url)  # sends wiki page
-            score_increment(ctx, 1)
-            if database.exists(f"race.data:{ctx.channel.id}"):
-
-                limit = int(database.hget(f"race.data:{ctx.channel.id}", "limit"))
-                first = database.zrevrange(f"race.scores:{ctx.channel.id}", 0, 0, True)[
-                    0
-                ]
-                if int(first[1]) >= limit:
+            if race_in_session:
+                limit, group, state, bw = race_data
+                if int(first[0][1]) >= int(limit):
                     logger.info("race ending")
                     race = self.bot.get_cog("Race")
                     await race.stop_race(ctx)
                 else:
                     logger.info("auto sending next image")
-                    group, state, bw = database.hmget(
-                        f"race.data:{ctx.channel.id}", ["group", "state", "bw"]
-                    )
                     media = self.bot.get_cog("Media")
                     await media.send_pic(
                         ctx,
@@ -135,9 +141,10 @@ class Check(commands.Cog):
                     )
 
         elif len(prompts.get(current_item, [])) != 0 and better_spellcheck(
-            arg, prompts.get(current_item, []), possible_words
+            arg, prompts.get(current_item, []), possible_words_index
         ):
             logger.info("prompt")
+            await pipe.execute()
             await ctx.send(
                 "Close, but not quite what we were looking for. Can you be more specific?"
             )
@@ -145,32 +152,46 @@ class Check(commands.Cog):
         else:
             logger.info("incorrect")
 
-            streak_increment(ctx, None)
-            session_increment(ctx, "incorrect", 1)
-            incorrect_increment(ctx, str(current_item), 1)
+            await streak_increment(ctx, None, pipe)
+            await session_increment(ctx, "incorrect", 1, pipe)
+            await incorrect_increment(ctx, str(current_item), 1, pipe)
 
-            if database.exists(f"race.data:{ctx.channel.id}"):
+            if race_in_session:
+                await pipe.execute()
                 await ctx.send("Sorry, that wasn't the right answer.")
             else:
-                database.hset(f"channel:{ctx.channel.id}", "item", "")
-                database.hset(f"channel:{ctx.channel.id}", "answered", "1")
+                pipe.hset(
+                    f"channel:{ctx.channel.id}", mapping={"item": "", "answered": "1"}
+                )
+                await pipe.execute()
                 await ctx.send("Sorry, the image was actually " + current_item + ".")
-                url = format_wiki_url(ctx, current_item)
+                url = await format_wiki_url(ctx, current_item)
                 await ctx.send(url)
 
     async def race_autocheck(self, message: discord.Message):
-        if not database.exists(f"race.data:{message.channel.id}"):
+        # most messages aren't guesses, so reject them without
+        # touching the database or running the full matcher
+        race = self.bot.get_cog("Race")
+        if race is None or message.channel.id not in race.active_channels:
             return
-        if len(get_close_matches(message.content.strip().lower(), possible_words)) != 0:
-            logger.info("race autocheck found: checking")
-            ctx = commands.Context(
-                message=message,
-                bot=self.bot,
-                prefix="race-autocheck",
-                view=discord.ext.commands.view.StringView(""),
-            )
-            await user_setup(ctx)
-            await self.check(ctx, arg=message.content)
+        guess = message.content.strip()
+        if not possible_words_index.might_match(guess, cutoff=0.6):
+            return
+        if possible_words_index.closest(guess, cutoff=0.6) is None:
+            return
+        if not await database.exists(f"race.data:{message.channel.id}"):
+            race.active_channels.discard(message.channel.id)
+            return
+
+        logger.info("race autocheck found: checking")
+        ctx = commands.Context(
+            message=message,
+            bot=self.bot,
+            prefix="race-autocheck",
+            view=discord.ext.commands.view.StringView(""),
+        )
+        await user_setup(ctx)
+        await self.check(ctx, arg=message.content)
 
 
 async def setup(bot):
@@ -43,9 +43,9 @@ class Hint(commands.Cog):
     ):
         logger.info("command: hint")
 
-        current_item = database.hget(f"channel:{ctx.channel.id}", "item").decode(
-            "utf-8"
-        )
+        current_item = (
+            await database.hget(f"channel:{ctx.channel.id}", "item")
+        ).decode("utf-8")
         if current_item != "":  # check if there is item
             if len(option) == 0 or option == "first":
                 await ctx.send(f"The first letter is {current_item[0]}.")
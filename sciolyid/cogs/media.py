@@ -14,15 +14,16 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
 import random
 import string
-from typing import Union
+from typing import Dict, Optional, Tuple, Union
 
 from discord import app_commands
 from discord.ext import commands
 
 import sciolyid.config as config
-from sciolyid.core import send_image
+from sciolyid.core import PreparedMedia, prepare_media, send_image
 from sciolyid.data import (
     GenericError,
     all_categories,
@@ -50,11 +51,49 @@ IMAGE_MESSAGE = (
 class Media(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # the next image for each race channel, loaded while players are guessing
+        self.prefetched: Dict[int, Tuple[tuple, asyncio.Task]] = {}
+
+    def clear_prefetch(self, channel_id: int):
+        """Cancels and removes the prefetched image for a channel."""
+        prefetch = self.prefetched.pop(channel_id, None)
+        if prefetch is not None:
+            prefetch[1].cancel()
+
+    @staticmethod
+    def _prefetch_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.info(f"prefetch failed: {task.exception()}")
+
+    def _start_prefetch(self, ctx, choices, options: tuple, current_item: str):
+        """Starts loading the next race image in the background."""
+        self.clear_prefetch(ctx.channel.id)
+        next_item = random.choice(choices)
+        while next_item == current_item and len(choices) > 1:
+            next_item = random.choice(choices)
+        logger.info(f"prefetching {next_item}")
+        task = asyncio.create_task(prepare_media(ctx, next_item, options[2]))
+        task.add_done_callback(self._prefetch_done)
+        self.prefetched[ctx.channel.id] = (options, task)
+
+    async def _take_prefetch(self, ctx, options: tuple) -> Optional[PreparedMedia]:
+        """Returns the prefetched image if it was loaded with the same options."""
+        prefetch = self.prefetched.pop(ctx.channel.id, None)
+        if prefetch is None:
+            return None
+        prefetch_options, task = prefetch
+        if prefetch_options != options:
+            task.cancel()
+            return None
+        try:
+            return await task
+        except (GenericError, OSError):
+            return None
 
     async def _send_race_next_media(self, ctx):
-        if database.exists(f"race.data:{ctx.channel.id}"):
+        if await database.exists(f"race.data:{ctx.channel.id}"):
             logger.info("auto sending next image")
-            group, state, bw = database.hmget(
+            group, state, bw = await database.hmget(
                 f"race.data:{ctx.channel.id}", ["group", "state", "bw"]
             )
             await self.send_pic(
@@ -68,8 +107,9 @@ class Media(commands.Cog):
             nonlocal retries
 
             # skip current item
-            database.hset(f"channel:{ctx.channel.id}", "item", "")
-            database.hset(f"channel:{ctx.channel.id}", "answered", "1")
+            await database.hset(
+                f"channel:{ctx.channel.id}", mapping={"item": "", "answered": "1"}
+            )
 
             if retries >= 2:  # only retry twice
                 await ctx.send("**Too many retries.**\n*Please try again.*")
@@ -87,10 +127,14 @@ class Media(commands.Cog):
         return inner
 
     @staticmethod
-    def increment_item_frequency(ctx, item):
-        item_setup(ctx, item)
-        database.zincrby("frequency.item:global", 1, string.capwords(item))
-        database.zincrby("frequency.item.refresh:global", 1, string.capwords(item))
+    async def increment_item_frequency(ctx, item, pipe=None):
+        execute = pipe is None
+        if execute:
+            pipe = database.pipeline()
+        await item_setup(ctx, item, pipe)
+        pipe.zincrby("frequency.item:global", 1, string.capwords(item))
+        if execute:
+            await pipe.execute()
 
     async def send_pic(
         self,
@@ -103,19 +147,26 @@ class Media(commands.Cog):
         if isinstance(bw, str):
             bw = bw == "bw"
 
-        logger.info(
-            f"{config.options['id_type'][:-1]}: "
-            + database.hget(f"channel:{ctx.channel.id}", "item").decode("utf-8")
+        pipe = database.pipeline()
+        pipe.hmget(f"channel:{ctx.channel.id}", ["item", "answered", "prevI"])
+        pipe.exists(f"race.data:{ctx.channel.id}")
+        pipe.zscore("users:global", str(ctx.author.id))
+        (item, answered, prevI), currently_in_race, user_score = (
+            await pipe.execute()
         )
 
-        currently_in_race = bool(database.exists(f"race.data:{ctx.channel.id}"))
-        new_user = database.zscore("users:global", str(ctx.author.id)) < 10
+        item = item.decode("utf-8")
+        logger.info(f"{config.options['id_type'][:-1]}: {item}")
+
+        currently_in_race = bool(currently_in_race)
+        new_user = (user_score or 0) < 10
 
-        answered = int(database.hget(f"channel:{ctx.channel.id}", "answered"))
+        answered = int(answered)
         logger.info(f"answered: {answered}")
         # check to see if previous item was answered
         if answered:  # if yes, give a new item
-            session_increment(ctx, "total", 1)
+            pipe = database.pipeline()
+            await session_increment(ctx, "total", 1, pipe)
 
             if not currently_in_race:
                 if config.options["id_groups"]:
@@ -130,6 +181,7 @@ class Media(commands.Cog):
             choices = build_id_list(group_str, state_str)
 
             if not choices:
+                await pipe.execute()
                 logger.info(f"no {config.options['id_type']} for taxon/state")
                 await ctx.send(
                     f"**Sorry, no {config.options['id_type']} could be found for the taxon/state combo."
@@ -138,6 +190,7 @@ class Media(commands.Cog):
                 return
 
             if len(choices) < 5:
+                await pipe.execute()
                 logger.info(f"list less than 5 items")
                 await ctx.send(
                     f"**Sorry, you must have at least 5 {config.options['id_type']} in the taxon/state combo."
@@ -145,16 +198,31 @@ class Media(commands.Cog):
                 )
                 return
 
-            current_item = random.choice(choices)
-            self.increment_item_frequency(ctx, current_item)
+            options = (group_str, state_str, bw)
+            prepared = None
+            if currently_in_race:
+                prepared = await self._take_prefetch(ctx, options)
 
-            prevI = database.hget(f"channel:{ctx.channel.id}", "prevI").decode("utf-8")
-            while current_item == prevI and len(choices) > 1:
+            prevI = prevI.decode("utf-8")
+            if prepared is not None and prepared.item != prevI:
+                logger.info("using prefetched image")
+                current_item = prepared.item
+            else:
+                prepared = None
                 current_item = random.choice(choices)
-            database.hset(f"channel:{ctx.channel.id}", "prevI", str(current_item))
-            database.hset(f"channel:{ctx.channel.id}", "item", str(current_item))
+                while current_item == prevI and len(choices) > 1:
+                    current_item = random.choice(choices)
+            await self.increment_item_frequency(ctx, current_item, pipe)
+            pipe.hset(
+                f"channel:{ctx.channel.id}",
+                mapping={
+                    "prevI": str(current_item),
+                    "item": str(current_item),
+                    "answered": "0",
+                },
+            )
+            await pipe.execute()
             logger.info("currentItem: " + str(current_item))
-            database.hset(f"channel:{ctx.channel.id}", "answered", "0")
             await send_image(
                 ctx,
                 current_item,
@@ -163,11 +231,14 @@ class Media(commands.Cog):
                 if not currently_in_race and new_user
                 else "*Here you go!*",
                 bw=bw,
+                prepared=prepared,
             )
+            if currently_in_race:
+                self._start_prefetch(ctx, choices, options, current_item)
         else:  # if no, give the same item
             await send_image(
                 ctx,
-                database.hget(f"channel:{ctx.channel.id}", "item").decode("utf-8"),
+                item,
                 on_error=self.error_handle(ctx, group_str, state_str, bw, retries),
                 message=IMAGE_MESSAGE
                 if not currently_in_race and new_user
@@ -184,7 +255,12 @@ class Media(commands.Cog):
 
         logger.info(f"args: {args}")
 
-        if not database.exists(f"race.data:{ctx.channel.id}"):
+        pipe = database.pipeline()
+        pipe.hmget(f"race.data:{ctx.channel.id}", ["bw", "group", "state"])
+        pipe.hmget(f"session.data:{ctx.author.id}", ["bw", "group", "state"])
+        race_data, session_data = await pipe.execute()
+
+        if race_data[0] is None:  # no race in session
             group_args = set()
             state_args = set()
             for arg in args:
@@ -200,15 +276,14 @@ class Media(commands.Cog):
                     return None
             group = " ".join(group_args).strip()
 
-            if database.exists(f"session.data:{ctx.author.id}"):
+            if session_data[0] is not None:
                 logger.info("session parameters")
+                session_bw, session_group, session_state = (
+                    value.decode("utf-8") for value in session_data
+                )
 
                 if group_args:
-                    current_groups = set(
-                        database.hget(f"session.data:{ctx.author.id}", "group")
-                        .decode("utf-8")
-                        .split(" ")
-                    )
+                    current_groups = set(session_group.split(" "))
                     logger.info(f"toggle groups: {group_args}")
                     logger.info(f"current groups: {current_groups}")
                     group_args.symmetric_difference_update(current_groups)
@@ -216,25 +291,16 @@ class Media(commands.Cog):
                     logger.info(f"new groups: {group_args}")
                     group = " ".join(group_args).strip()
                 else:
-                    group = database.hget(
-                        f"session.data:{ctx.author.id}", "group"
-                    ).decode("utf-8")
-
-                chosen_state = (
-                    database.hget(f"session.data:{ctx.author.id}", "state")
-                    .decode("utf-8")
-                    .split(" ")
-                )
+                    group = session_group
+
+                chosen_state = session_state.split(" ")
                 if chosen_state[0] == "":
                     chosen_state = []
                 if not chosen_state:
                     logger.info("no session lists")
                     chosen_state = check_state_role(ctx)
 
-                session_bw = (
-                    database.hget(f"session.data:{ctx.author.id}", "bw").decode("utf-8")
-                    == "bw"
-                )
+                session_bw = session_bw == "bw"
                 bw = not session_bw if "bw" in args else session_bw
             else:
                 chosen_state = check_state_role(ctx)
@@ -253,19 +319,10 @@ class Media(commands.Cog):
         else:
             logger.info("race parameters")
 
-            race_bw = (
-                database.hget(f"race.data:{ctx.channel.id}", "bw").decode("utf-8")
-                == "bw"
-            )
+            race_bw, group, state = (value.decode("utf-8") for value in race_data)
+            race_bw = race_bw == "bw"
             bw = not race_bw if "bw" in args else race_bw
 
-            group = database.hget(f"race.data:{ctx.channel.id}", "group").decode(
-                "utf-8"
-            )
-            state = database.hget(f"race.data:{ctx.channel.id}", "state").decode(
-                "utf-8"
-            )
-
         logger.info(f"args: bw: {bw}; group: {group}; state: {state}")
 
         return (bw, group, state)
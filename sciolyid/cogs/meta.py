@@ -124,19 +124,19 @@ class Meta(commands.Cog):
         added = ""
         removed = ""
         for channel in channels:
-            if database.zscore("ignore:global", str(channel.id)) is None:
+            if await database.zscore("ignore:global", str(channel.id)) is None:
                 added += f"`#{esc(channel.name)}` (`{esc(channel.category.name) if channel.category else 'No Category'}`)\n"
-                database.zadd("ignore:global", {str(channel.id): ctx.guild.id})
+                await database.zadd("ignore:global", {str(channel.id): ctx.guild.id})
             else:
                 removed += f"`#{esc(channel.name)}` (`{esc(channel.category.name) if channel.category else 'No Category'}`)\n"
-                database.zrem("ignore:global", str(channel.id))
+                await database.zrem("ignore:global", str(channel.id))
 
         ignored = "".join(
             [
                 f"`#{esc(channel.name)}` (`{esc(channel.category.name) if channel.category else 'No Category'}`)\n"
                 for channel in map(
                     lambda c: ctx.guild.get_channel(int(c)),
-                    database.zrangebyscore(
+                    await database.zrangebyscore(
                         "ignore:global", ctx.guild.id - 0.1, ctx.guild.id + 0.1
                     ),
                 )
@@ -163,12 +163,12 @@ class Meta(commands.Cog):
         async def noholiday(self, ctx: commands.Context):
             logger.info("command: noholiday")
 
-            if not database.sismember("noholiday:global", str(ctx.guild.id)):
+            if not await database.sismember("noholiday:global", str(ctx.guild.id)):
                 await ctx.send("**Holidays are now disabled in this server.**")
-                database.sadd("noholiday:global", str(ctx.guild.id))
+                await database.sadd("noholiday:global", str(ctx.guild.id))
             else:
                 await ctx.send("**Holidays are now enabled in this server.**")
-                database.srem("noholiday:global", str(ctx.guild.id))
+                await database.srem("noholiday:global", str(ctx.guild.id))
 
     # leave command - removes itself from guild
     @commands.hybrid_command(
@@ -185,21 +185,21 @@ class Meta(commands.Cog):
     ):
         logger.info("command: leave")
 
-        if database.exists(f"leave:{ctx.guild.id}"):
+        if await database.exists(f"leave:{ctx.guild.id}"):
             logger.info("confirming")
             if confirm:
                 logger.info(f"confirmed. Leaving {ctx.guild}")
-                database.delete(f"leave:{ctx.guild.id}")
+                await database.delete(f"leave:{ctx.guild.id}")
                 await ctx.send("**Ok, bye!**")
                 await ctx.guild.leave()
                 return
             logger.info("confirm failed. leave canceled")
-            database.delete(f"leave:{ctx.guild.id}")
+            await database.delete(f"leave:{ctx.guild.id}")
             await ctx.send("**Leave canceled.**")
             return
 
         logger.info("not confirmed")
-        database.set(f"leave:{ctx.guild.id}", 0, ex=60)
+        await database.set(f"leave:{ctx.guild.id}", 0, ex=60)
         await ctx.send(
             "**Are you sure you want to remove me from the guild?**\n"
             + f"Use `{config.options['prefixes'][0]}leave yes` to confirm, `{config.options['prefixes'][0]}leave no` to cancel. "
@@ -221,7 +221,7 @@ class Meta(commands.Cog):
             await ctx.send("Invalid User!")
             return
         logger.info(f"user-id: {user.id}")
-        database.zadd("banned:global", {str(user.id): 0})
+        await database.zadd("banned:global", {str(user.id): 0})
         await ctx.send(f"Ok, {esc(user.name)} cannot use the bot anymore!")
 
     # unban command - prevents certain users from using the bot
@@ -239,7 +239,7 @@ class Meta(commands.Cog):
             await ctx.send("Invalid User!")
             return
         logger.info(f"user-id: {user.id}")
-        database.zrem("banned:global", str(user.id))
+        await database.zrem("banned:global", str(user.id))
         await ctx.send(f"Ok, {esc(user.name)} can use the bot!")
 
     # correct command - see how many times someone got a specimen correct
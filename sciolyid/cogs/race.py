@@ -20,7 +20,6 @@ import time
 import discord
 from discord import app_commands
 from discord.ext import commands
-from discord.utils import escape_markdown as esc
 
 import sciolyid.config as config
 from sciolyid.data import (
@@ -31,17 +30,26 @@ from sciolyid.data import (
     logger,
     states,
 )
-from sciolyid.functions import CustomCooldown
-from sciolyid.util import fetch_get_user
+from sciolyid.functions import CustomCooldown, format_users
 
 
 class Race(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # ids of channels with a race in progress, so message handlers
+        # can skip other channels without a database lookup
+        self.active_channels = set()
+
+    async def cog_load(self):
+        logger.info("loading active races")
+        self.active_channels = {
+            int(key.decode("utf-8").split(":")[1])
+            async for key in database.scan_iter(match="race.data:*")
+        }
 
     @staticmethod
-    def _get_options(ctx: commands.Context):
-        bw, state, group, limit, strict = database.hmget(
+    async def _get_options(ctx: commands.Context):
+        bw, state, group, limit, strict = await database.hmget(
             f"race.data:{ctx.channel.id}", ["bw", "state", "group", "limit", "strict"]
         )
         options = (
@@ -61,15 +69,15 @@ class Race(commands.Cog):
     async def _send_stats(self, ctx: commands.Context, preamble):
         placings = 5
         database_key = f"race.scores:{ctx.channel.id}"
-        if database.zcard(database_key) == 0:
+        if await database.zcard(database_key) == 0:
             logger.info(f"no users in {database_key}")
             await ctx.send("There are no users in the database.")
             return
 
-        if placings > database.zcard(database_key):
-            placings = database.zcard(database_key)
+        if placings > await database.zcard(database_key):
+            placings = await database.zcard(database_key)
 
-        leaderboard_list = database.zrevrangebyscore(
+        leaderboard_list = await database.zrevrangebyscore(
             database_key, "+inf", "-inf", 0, placings, True
         )
         embed = discord.Embed(
@@ -77,37 +85,24 @@ class Race(commands.Cog):
         )
         embed.set_author(name=config.options["bot_signature"])
         leaderboard = ""
+        user_info = await format_users(ctx, (stats[0] for stats in leaderboard_list))
 
         for i, stats in enumerate(leaderboard_list):
-            if ctx.guild is not None:
-                user = await fetch_get_user(int(stats[0]), ctx=ctx, member=True)
-            else:
-                user = None
-
-            if user is None:
-                user = await fetch_get_user(int(stats[0]), ctx=ctx, member=False)
-                if user is None:
-                    user_info = "**Deleted**"
-                else:
-                    user_info = f"**{esc(user.name)}#{user.discriminator}**"
-            else:
-                user_info = (
-                    f"**{esc(user.name)}#{user.discriminator}** ({user.mention})"
-                )
+            leaderboard += f"{i+1}. {user_info[int(stats[0])]} - {int(stats[1])}\n"
 
-            leaderboard += f"{i+1}. {user_info} - {int(stats[1])}\n"
-
-        start = int(database.hget(f"race.data:{ctx.channel.id}", "start"))
+        start = int(await database.hget(f"race.data:{ctx.channel.id}", "start"))
         elapsed = str(datetime.timedelta(seconds=round(time.time()) - start))
 
-        embed.add_field(name="Options", value=self._get_options(ctx), inline=False)
+        embed.add_field(name="Options", value=await self._get_options(ctx), inline=False)
         embed.add_field(
             name="Stats", value=f"**Race Duration:** `{elapsed}`", inline=False
         )
         embed.add_field(name="Leaderboard", value=leaderboard, inline=False)
 
-        if database.zscore(database_key, str(ctx.author.id)) is not None:
-            placement = int(database.zrevrank(database_key, str(ctx.author.id))) + 1
+        if await database.zscore(database_key, str(ctx.author.id)) is not None:
+            placement = (
+                int(await database.zrevrank(database_key, str(ctx.author.id))) + 1
+            )
             embed.add_field(name="You:", value=f"You are #{placement}.", inline=False)
         else:
             embed.add_field(name="You:", value="You haven't answered any correctly.")
@@ -115,20 +110,10 @@ class Race(commands.Cog):
         await ctx.send(embed=embed)
 
     async def stop_race(self, ctx: commands.Context):
-        first = database.zrevrange(f"race.scores:{ctx.channel.id}", 0, 0, True)[0]
-        if ctx.guild is not None:
-            user = await fetch_get_user(int(first[0]), ctx=ctx, member=True)
-        else:
-            user = None
-
-        if user is None:
-            user = await fetch_get_user(int(first[0]), ctx=ctx, member=False)
-            if user is None:
-                user_info = "Deleted"
-            else:
-                user_info = f"{esc(user.name)}#{user.discriminator}"
-        else:
-            user_info = f"{esc(user.name)}#{user.discriminator} ({user.mention})"
+        first = (
+            await database.zrevrange(f"race.scores:{ctx.channel.id}", 0, 0, True)
+        )[0]
+        user_info = (await format_users(ctx, (first[0],), bold=False))[int(first[0])]
 
         await ctx.send(
             f"**Congratulations, {user_info}!**\n"
@@ -136,11 +121,17 @@ class Race(commands.Cog):
             + "*Way to go!*"
         )
 
-        database.hset(f"race.data:{ctx.channel.id}", "stop", round(time.time()))
+        await database.hset(
+            f"race.data:{ctx.channel.id}", "stop", round(time.time())
+        )
 
         await self._send_stats(ctx, "**Race stopped.**")
-        database.delete(f"race.data:{ctx.channel.id}")
-        database.delete(f"race.scores:{ctx.channel.id}")
+        await database.delete(f"race.data:{ctx.channel.id}")
+        await database.delete(f"race.scores:{ctx.channel.id}")
+        self.active_channels.discard(ctx.channel.id)
+        media = self.bot.get_cog("Media")
+        if media is not None:
+            media.clear_prefetch(ctx.channel.id)
 
     @commands.hybrid_group(
         brief=f"- Base race command. Use '{config.options['prefixes'][0]}help race' for more info.",
@@ -184,7 +175,7 @@ class Race(commands.Cog):
             )
             return
 
-        if database.exists(f"race.data:{ctx.channel.id}"):
+        if await database.exists(f"race.data:{ctx.channel.id}"):
             logger.info("already race")
             await ctx.send(
                 f"**There is already a race in session.** *View stats with `{config.options['prefixes'][0]}race view`*"
@@ -229,7 +220,7 @@ class Race(commands.Cog):
 
         logger.info(f"bw: {bw}; group: {group}; state: {state}; limit: {limit}")
 
-        database.hset(
+        await database.hset(
             f"race.data:{ctx.channel.id}",
             mapping={
                 "start": round(time.time()),
@@ -242,14 +233,16 @@ class Race(commands.Cog):
             },
         )
 
-        database.zadd(f"race.scores:{ctx.channel.id}", {str(ctx.author.id): 0})
+        await database.zadd(f"race.scores:{ctx.channel.id}", {str(ctx.author.id): 0})
+        self.active_channels.add(ctx.channel.id)
         await ctx.send(
-            f"**Race started with options:**\n{self._get_options(ctx)}"
+            f"**Race started with options:**\n{await self._get_options(ctx)}"
         )
 
         logger.info("clearing previous item")
-        database.hset(f"channel:{ctx.channel.id}", "item", "")
-        database.hset(f"channel:{ctx.channel.id}", "answered", "1")
+        await database.hset(
+            f"channel:{ctx.channel.id}", mapping={"item": "", "answered": "1"}
+        )
 
         logger.info("auto sending next item")
         media = self.bot.get_cog("Media")
@@ -264,7 +257,7 @@ class Race(commands.Cog):
     async def view(self, ctx: commands.Context):
         logger.info("command: view race")
 
-        if database.exists(f"race.data:{ctx.channel.id}"):
+        if await database.exists(f"race.data:{ctx.channel.id}"):
             await self._send_stats(ctx, "**Race In Progress**")
         else:
             await ctx.send(
@@ -276,7 +269,7 @@ class Race(commands.Cog):
     async def stop(self, ctx: commands.Context):
         logger.info("command: stop race")
 
-        if database.exists(f"race.data:{ctx.channel.id}"):
+        if await database.exists(f"race.data:{ctx.channel.id}"):
             await self.stop_race(ctx)
         else:
             await ctx.send(
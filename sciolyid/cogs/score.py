@@ -18,36 +18,45 @@ import datetime
 from typing import Literal, Optional, Union
 
 import discord
-import pandas as pd
 from discord import app_commands
 from discord.ext import commands
-from discord.utils import escape_markdown as esc
 
 import sciolyid.config as config
 from sciolyid.data import GenericError, database, logger
-from sciolyid.functions import CustomCooldown, send_leaderboard
-from sciolyid.util import fetch_get_user
+from sciolyid.data_functions import migrate_server_scores
+from sciolyid.functions import CustomCooldown, format_users, send_leaderboard
 
+# seconds a monthly leaderboard is kept after it needs to be regenerated
+MONTHLY_LB_GRACE = 60
 
 class Score(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    async def cog_load(self):
+        await migrate_server_scores()
+
     @staticmethod
-    def _server_total(ctx: commands.Context):
+    async def _server_total(ctx: commands.Context):
         logger.info("fetching server totals")
         channels = map(
             lambda x: x.decode("utf-8"),
-            database.smembers(f"channels:{ctx.guild.id}"),
+            await database.smembers(f"channels:{ctx.guild.id}"),
         )
         pipe = database.pipeline()  # use a pipeline to get all the scores
         for channel in channels:
             pipe.zscore("score:global", channel)
-        scores = pipe.execute()
+        scores = await pipe.execute()
         return int(sum(map(lambda x: x or 0, scores)))
 
     @staticmethod
-    def _monthly_lb(category):
+    async def _monthly_lb(category):
+        """Returns the key of a sorted set with totals from the last 30 days.
+
+        The totals are computed in Redis with ZUNIONSTORE and cached
+        for `monthly_lb_ttl` seconds. The key is kept for another
+        minute after that, so it doesn't expire while it's being read.
+        """
         logger.info("generating monthly leaderboard")
         if category == "scores":
             key = "daily.score"
@@ -57,47 +66,26 @@ class Score(commands.Cog):
             raise GenericError("Invalid category", 990)
 
         today = datetime.datetime.now(datetime.timezone.utc).date()
-        past_month = pd.date_range(  # pylint: disable=no-member
-            today - datetime.timedelta(29), today
-        ).date
-        pipe = database.pipeline()
-        for day in past_month:
-            pipe.zrevrangebyscore(f"{key}:{day}", "+inf", "-inf", withscores=True)
-        result = pipe.execute()
-        totals = pd.Series(dtype="int64")
-        for daily_score in result:
-            daily_score = pd.Series(
-                {
-                    e[0]: e[1]
-                    for e in map(
-                        lambda x: (x[0].decode("utf-8"), int(x[1])), daily_score
-                    )
-                }
-            )
-            totals = totals.add(daily_score, fill_value=0)
-        totals = totals.sort_values(ascending=False)
-        return totals
+        month_key = f"monthly.{key.split('.')[1]}:{today}"
+        # the ttl is -2 if the key doesn't exist
+        if await database.ttl(month_key) > MONTHLY_LB_GRACE:
+            logger.info("using cached monthly leaderboard")
+            return month_key
 
-    @staticmethod
-    def _server_lb(guild_id):
-        logger.info("generating server leaderboard")
-        users = tuple(
-            map(
-                lambda x: x.decode("utf8"),
-                database.smembers(f"users.server.id:{guild_id}"),
-            )
-        )
+        past_month = (today - datetime.timedelta(days) for days in range(30))
         pipe = database.pipeline()
-        for user in users:
-            pipe.zscore("users:global", user)
-        scores = map(int, pipe.execute())
-        score_series = pd.Series(scores, index=users, dtype="int64").sort_values(
-            ascending=False
-        )
-        return score_series
+        pipe.zunionstore(month_key, [f"{key}:{day}" for day in past_month])
+        pipe.expire(month_key, config.options["monthly_lb_ttl"] + MONTHLY_LB_GRACE)
+        await pipe.execute()
+        return month_key
 
     @staticmethod
     async def user_lb(ctx: commands.Context, title, page, database_key=None, data=None):
+        """Sends a leaderboard of users.
+
+        `data` is a list of (user id, score) tuples sorted from highest to lowest,
+        used instead of `database_key`.
+        """
         if database_key is None and data is None:
             raise GenericError("database_key and data are both NoneType", 990)
         if database_key is not None and data is not None:
@@ -106,9 +94,9 @@ class Score(commands.Cog):
         page = max(1, page)
 
         user_amount = (
-            int(database.zcard(database_key))
+            int(await database.zcard(database_key))
             if database_key is not None
-            else data.count()
+            else len(data)
         )
         page = (page * 10) - 10
 
@@ -122,55 +110,44 @@ class Score(commands.Cog):
 
         users_per_page = 10
         leaderboard_list = (
-            database.zrevrangebyscore(
+            await database.zrevrangebyscore(
                 database_key, "+inf", "-inf", page, users_per_page, True
             )
             if database_key is not None
-            else data.iloc[page : page + users_per_page - 1].items()
+            else data[page : page + users_per_page]
         )
 
         embed = discord.Embed(type="rich", colour=discord.Color.blurple())
         embed.set_author(name=config.options["bot_signature"])
         leaderboard = ""
+        user_info = await format_users(ctx, (stats[0] for stats in leaderboard_list))
 
         for i, stats in enumerate(leaderboard_list):
-            if ctx.guild is not None:
-                user = await fetch_get_user(int(stats[0]), ctx=ctx, member=True)
-            else:
-                user = None
-
-            if user is None:
-                user = await fetch_get_user(int(stats[0]), ctx=ctx, member=False)
-                if user is None:
-                    user_info = "**Deleted**"
-                else:
-                    user_info = f"**{esc(user.name)}#{user.discriminator}**"
-            else:
-                user_info = (
-                    f"**{esc(user.name)}#{user.discriminator}** ({user.mention})"
-                )
-
-            leaderboard += f"{i+1+page}. {user_info} - {int(stats[1])}\n"
+            leaderboard += f"{i+1+page}. {user_info[int(stats[0])]} - {int(stats[1])}\n"
 
         embed.add_field(name=title, value=leaderboard, inline=False)
 
-        user_score = (
-            database.zscore(database_key, str(ctx.author.id))
-            if database_key is not None
-            else data.get(str(ctx.author.id))
-        )
+        if database_key is not None:
+            pipe = database.pipeline()
+            pipe.zscore(database_key, str(ctx.author.id))
+            pipe.zrevrank(database_key, str(ctx.author.id))
+            user_score, rank = await pipe.execute()
+        else:
+            user_score = dict(data).get(str(ctx.author.id))
 
         if user_score is not None:
             if database_key is not None:
-                placement = int(database.zrevrank(database_key, str(ctx.author.id))) + 1
+                placement = int(rank) + 1
                 distance = int(
-                    database.zrevrange(
-                        database_key, placement - 2, placement - 2, True
+                    (
+                        await database.zrevrange(
+                            database_key, placement - 2, placement - 2, True
+                        )
                     )[0][1]
                 ) - int(user_score)
             else:
-                placement = int(data.rank(ascending=False)[str(ctx.author.id)])
-                distance = int(data.iloc[placement - 2] - user_score)
+                placement = [user for user, _ in data].index(str(ctx.author.id)) + 1
+                distance = int(data[placement - 2][1] - user_score)
 
             if placement == 1:
                 embed.add_field(
@@ -211,13 +188,15 @@ class Score(commands.Cog):
         logger.info("command: score")
 
         if scope in ("total", "server", "t", "s"):
-            total_correct = self._server_total(ctx)
+            total_correct = await self._server_total(ctx)
             await ctx.send(
                 f"Wow, looks like a total of `{total_correct}` {config.options['id_type']} have been answered correctly in this **server**!\n"
                 + "Good job everyone!"
             )
         else:
-            total_correct = int(database.zscore("score:global", str(ctx.channel.id)))
+            total_correct = int(
+                await database.zscore("score:global", str(ctx.channel.id))
+            )
             await ctx.send(
                 f"Wow, looks like a total of `{total_correct}` {config.options['id_type']} have been answered correctly in this **channel**!\n"
                 + "Good job everyone!"
@@ -246,7 +225,7 @@ class Score(commands.Cog):
                 return
             usera = user.id
             logger.info(usera)
-            score = database.zscore("users:global", str(usera))
+            score = await database.zscore("users:global", str(usera))
             if score is not None:
                 score = int(score)
                 user = f"<@{usera}>"
@@ -256,7 +235,7 @@ class Score(commands.Cog):
                 )
                 return
         else:
-            score = database.zscore("users:global", str(ctx.author.id))
+            score = await database.zscore("users:global", str(ctx.author.id))
             if score is not None:
                 user = f"<@{ctx.author.id}>"
                 score = int(score)
@@ -294,8 +273,8 @@ class Score(commands.Cog):
                 return
             usera = user.id
             logger.info(usera)
-            streak = database.zscore("streak:global", str(usera))
-            max_streak = database.zscore("streak.max:global", str(usera))
+            streak = await database.zscore("streak:global", str(usera))
+            max_streak = await database.zscore("streak.max:global", str(usera))
             if streak is not None and max_streak is not None:
                 streak = int(streak)
                 max_streak = int(max_streak)
@@ -307,8 +286,10 @@ class Score(commands.Cog):
                 return
         else:
             user = f"<@{ctx.author.id}>"
-            streak = int(database.zscore("streak:global", str(ctx.author.id)))
-            max_streak = int(database.zscore("streak.max:global", str(ctx.author.id)))
+            streak = int(await database.zscore("streak:global", str(ctx.author.id)))
+            max_streak = int(
+                await database.zscore("streak.max:global", str(ctx.author.id))
+            )
 
         embed = discord.Embed(
             type="rich", colour=discord.Color.blurple(), title="**User Streaks**"
@@ -419,8 +400,8 @@ class Score(commands.Cog):
 
         if scope in ("server", "s"):
             if ctx.guild is not None:
-                database_key = None
-                data = self._server_lb(ctx.guild.id)
+                database_key = f"users.server.score:{ctx.guild.id}"
+                data = None
                 scope = "server"
             else:
                 logger.info("dm context")
@@ -431,9 +412,9 @@ class Score(commands.Cog):
                 database_key = "users:global"
                 data = None
         elif scope in ("month", "monthly", "m"):
-            database_key = None
+            database_key = await self._monthly_lb("scores")
             scope = "Last 30 Days"
-            data = self._monthly_lb("scores")
+            data = None
         else:
             database_key = "users:global"
             scope = "global"
@@ -513,9 +494,9 @@ class Score(commands.Cog):
             scope = "me"
             data = None
         elif scope in ("month", "monthly", "mo"):
-            database_key = None
+            database_key = await self._monthly_lb("missed")
             scope = "Last 30 days"
-            data = self._monthly_lb("missed")
+            data = None
         else:
             database_key = "incorrect:global"
             scope = "global"
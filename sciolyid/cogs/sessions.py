@@ -38,8 +38,8 @@ class Sessions(commands.Cog):
         self.bot = bot
 
     @staticmethod
-    def _get_options(ctx: commands.Context):
-        bw, state, group, wiki, strict = database.hmget(
+    async def _get_options(ctx: commands.Context):
+        bw, state, group, wiki, strict = await database.hmget(
             f"session.data:{ctx.author.id}", ["bw", "state", "group", "wiki", "strict"]
         )
         options = (
@@ -57,10 +57,10 @@ class Sessions(commands.Cog):
         return options
 
     @staticmethod
-    def _get_stats(ctx: commands.Context):
+    async def _get_stats(ctx: commands.Context):
         start, correct, incorrect, total = map(
             int,
-            database.hmget(
+            await database.hmget(
                 f"session.data:{ctx.author.id}",
                 ["start", "correct", "incorrect", "total"],
             ),
@@ -88,8 +88,8 @@ class Sessions(commands.Cog):
         )
         embed.set_author(name=config.options["bot_signature"])
 
-        if database.zcard(database_key) != 0:
-            leaderboard_list = database.zrevrangebyscore(
+        if await database.zcard(database_key) != 0:
+            leaderboard_list = await database.zrevrangebyscore(
                 database_key, "+inf", "-inf", 0, 5, True
             )
             leaderboard = ""
@@ -102,8 +102,8 @@ class Sessions(commands.Cog):
             logger.info(f"no items in {database_key}")
             leaderboard = f"**There are no missed {config.options['id_type']}.**"
 
-        embed.add_field(name="Options", value=self._get_options(ctx), inline=False)
-        embed.add_field(name="Stats", value=self._get_stats(ctx), inline=False)
+        embed.add_field(name="Options", value=await self._get_options(ctx), inline=False)
+        embed.add_field(name="Stats", value=await self._get_stats(ctx), inline=False)
         embed.add_field(
             name=f"Top Missed {config.options['id_type'].title()}",
             value=leaderboard,
@@ -147,7 +147,7 @@ class Sessions(commands.Cog):
     async def start(self, ctx: commands.Context, *, args_str: str = ""):
         logger.info("command: start session")
 
-        if database.exists(f"session.data:{ctx.author.id}"):
+        if await database.exists(f"session.data:{ctx.author.id}"):
             logger.info("already session")
             await ctx.send(
                 f"**There is already a session running.** *Change settings/view stats with `{config.options['prefixes'][0]}session edit`*"
@@ -193,7 +193,7 @@ class Sessions(commands.Cog):
             f"adding bw: {bw}; group: {group}; state: {state}; wiki: {wiki}; strict: {strict}"
         )
 
-        database.hset(
+        await database.hset(
             f"session.data:{ctx.author.id}",
             mapping={
                 "start": round(time.time()),
@@ -208,7 +208,9 @@ class Sessions(commands.Cog):
                 "strict": strict,
             },
         )
-        await ctx.send(f"**Session started with options:**\n{self._get_options(ctx)}")
+        await ctx.send(
+            f"**Session started with options:**\n{await self._get_options(ctx)}"
+        )
 
     # views session
     @session.command(
@@ -230,7 +232,7 @@ class Sessions(commands.Cog):
     async def edit(self, ctx: commands.Context, *, args_str: str = ""):
         logger.info("command: view session")
 
-        if not database.exists(f"session.data:{ctx.author.id}"):
+        if not await database.exists(f"session.data:{ctx.author.id}"):
             await ctx.send(
                 f"**There is no session running.** *You can start one with `{config.options['prefixes'][0]}session start`*"
             )
@@ -245,26 +247,34 @@ class Sessions(commands.Cog):
         for arg in set(args):
             arg = arg.lower()
             if arg == "bw":
-                if not database.hget(f"session.data:{ctx.author.id}", "bw"):
+                if not await database.hget(f"session.data:{ctx.author.id}", "bw"):
                     logger.info("adding bw")
-                    database.hset(f"session.data:{ctx.author.id}", "bw", "bw")
+                    await database.hset(
+                        f"session.data:{ctx.author.id}", "bw", "bw"
+                    )
                 else:
                     logger.info("removing bw")
-                    database.hset(f"session.data:{ctx.author.id}", "bw", "")
+                    await database.hset(f"session.data:{ctx.author.id}", "bw", "")
             elif arg == "wiki":
-                if database.hget(f"session.data:{ctx.author.id}", "wiki"):
+                if await database.hget(f"session.data:{ctx.author.id}", "wiki"):
                     logger.info("disabling wiki embeds")
-                    database.hset(f"session.data:{ctx.author.id}", "wiki", "")
+                    await database.hset(f"session.data:{ctx.author.id}", "wiki", "")
                 else:
                     logger.info("enabling wiki embeds")
-                    database.hset(f"session.data:{ctx.author.id}", "wiki", "wiki")
+                    await database.hset(
+                        f"session.data:{ctx.author.id}", "wiki", "wiki"
+                    )
             elif arg == "strict":
-                if database.hget(f"session.data:{ctx.author.id}", "strict"):
+                if await database.hget(f"session.data:{ctx.author.id}", "strict"):
                     logger.info("disabling strict spelling")
-                    database.hset(f"session.data:{ctx.author.id}", "strict", "")
+                    await database.hset(
+                        f"session.data:{ctx.author.id}", "strict", ""
+                    )
                 else:
                     logger.info("enabling strict spelling")
-                    database.hset(f"session.data:{ctx.author.id}", "strict", "strict")
+                    await database.hset(
+                        f"session.data:{ctx.author.id}", "strict", "strict"
+                    )
             elif arg in all_categories:
                 group_args.add(dealias_group(arg))
             elif arg.upper() in states.keys():
@@ -275,7 +285,7 @@ class Sessions(commands.Cog):
 
         if state_args:
             current_states = set(
-                database.hget(f"session.data:{ctx.author.id}", "state")
+                (await database.hget(f"session.data:{ctx.author.id}", "state"))
                 .decode("utf-8")
                 .split(" ")
             )
@@ -284,7 +294,7 @@ class Sessions(commands.Cog):
             state_args.symmetric_difference_update(current_states)
             state_args.discard("")
             logger.info(f"new states: {state_args}")
-            database.hset(
+            await database.hset(
                 f"session.data:{ctx.author.id}",
                 "state",
                 " ".join(state_args).strip(),
@@ -292,7 +302,7 @@ class Sessions(commands.Cog):
 
         if group_args and config.options["id_groups"]:
             current_group = set(
-                database.hget(f"session.data:{ctx.author.id}", "group")
+                (await database.hget(f"session.data:{ctx.author.id}", "group"))
                 .decode("utf-8")
                 .split(" ")
             )
@@ -301,7 +311,7 @@ class Sessions(commands.Cog):
             group_args.symmetric_difference_update(current_group)
             group_args.discard("")
             logger.info(f"new groups: {group_args}")
-            database.hset(
+            await database.hset(
                 f"session.data:{ctx.author.id}",
                 "group",
                 " ".join(group_args).strip(),
@@ -314,12 +324,14 @@ class Sessions(commands.Cog):
     async def stop(self, ctx: commands.Context):
         logger.info("command: stop session")
 
-        if database.exists(f"session.data:{ctx.author.id}"):
-            database.hset(f"session.data:{ctx.author.id}", "stop", round(time.time()))
+        if await database.exists(f"session.data:{ctx.author.id}"):
+            await database.hset(
+                f"session.data:{ctx.author.id}", "stop", round(time.time())
+            )
 
             await self._send_stats(ctx, "**Session stopped.**\n")
-            database.delete(f"session.data:{ctx.author.id}")
-            database.delete(f"session.incorrect:{ctx.author.id}")
+            await database.delete(f"session.data:{ctx.author.id}")
+            await database.delete(f"session.incorrect:{ctx.author.id}")
         else:
             await ctx.send(
                 f"**There is no session running.** *You can start one with `{config.options['prefixes'][0]}session start`*"
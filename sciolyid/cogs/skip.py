@@ -31,21 +31,19 @@ class Skip(commands.Cog):
     async def skip(self, ctx: commands.Context):
         logger.info("command: skip")
 
-        current_item = database.hget(f"channel:{ctx.channel.id}", "item").decode(
-            "utf-8"
-        )
-        database.hset(f"channel:{ctx.channel.id}", "item", "")
-        database.hset(f"channel:{ctx.channel.id}", "answered", "1")
+        pipe = database.pipeline()
+        pipe.hget(f"channel:{ctx.channel.id}", "item")
+        pipe.hset(f"channel:{ctx.channel.id}", mapping={"item": "", "answered": "1"})
+        pipe.hmget(f"race.data:{ctx.channel.id}", ["group", "state", "bw"])
+        current_item, _, (group, state, bw) = await pipe.execute()
+        current_item = current_item.decode("utf-8")
         if current_item:  # check if there is image
-            url = format_wiki_url(ctx, current_item)
+            url = await format_wiki_url(ctx, current_item)
             await ctx.send(f"Ok, skipping {current_item.lower()}")
             await ctx.send(url)  # sends wiki page
-            streak_increment(ctx, None)  # reset streak
-            if database.exists(f"race.data:{ctx.channel.id}"):
+            await streak_increment(ctx, None)  # reset streak
+            if group is not None:  # race in session
                 logger.info("auto sending next image")
-                group, state, bw = database.hmget(
-                    f"race.data:{ctx.channel.id}", ["group", "state", "bw"]
-                )
                 media = self.bot.get_cog("Media")
                 await media.send_pic(ctx, group.decode("utf-8"), state.decode("utf-8"), bw.decode("utf-8"))
         else:
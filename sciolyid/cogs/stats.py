@@ -14,20 +14,20 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import csv
 import datetime
+import statistics
 from io import BytesIO, StringIO
 from typing import Literal
 
 import discord
-import numpy as np
-import pandas as pd
 from discord import app_commands
 from discord.ext import commands
 
 import sciolyid.config as config
 from sciolyid.data import database, logger
 from sciolyid.functions import CustomCooldown, send_leaderboard
-from sciolyid.util import fetch_get_user
+from sciolyid.util import fetch_get_users
 
 
 def auto_options(options):
@@ -42,48 +42,59 @@ class Stats(commands.Cog):
         self.bot = bot
 
     @staticmethod
-    def generate_series(database_key):
-        """Generates a pandas.Series from a Redis sorted set."""
+    async def generate_series(database_key):
+        """Generates a list of scores from a Redis sorted set, highest first."""
         logger.info("generating series")
-        data = database.zrevrangebyscore(database_key, "+inf", "-inf", withscores=True)
-        return pd.Series(
-            {e[0]: e[1] for e in map(lambda x: (x[0].decode("utf-8"), int(x[1])), data)}
+        data = await database.zrevrangebyscore(
+            database_key, "+inf", "-inf", withscores=True
         )
+        return [int(score) for _, score in data]
 
     @staticmethod
-    def generate_dataframe(database_keys, titles):
-        """Generates a pandas.DataFrame from multiple Redis sorted sets."""
+    async def generate_table(database_keys):
+        """Generates rows from multiple Redis sorted sets.
+
+        Returns a list of tuples of the member and a list of its score in each
+        sorted set, or 0 if it isn't in that set.
+        """
+        logger.info("generating table")
         pipe = database.pipeline()
         for key in database_keys:
             pipe.zrevrangebyscore(key, "+inf", "-inf", withscores=True)
-        result = pipe.execute()
-        df = pd.DataFrame()
+        result = await pipe.execute()
+        rows = {}
         for i, item in enumerate(result):
-            df.insert(
-                len(df.columns),
-                titles[i],
-                pd.Series(
-                    {
-                        e[0]: e[1]
-                        for e in map(lambda x: (x[0].decode("utf-8"), int(x[1])), item)
-                    }
-                ),
+            for member, score in item:
+                row = rows.setdefault(member.decode("utf-8"), [0] * len(result))
+                row[i] = int(score)
+        return list(rows.items())
+
+    @staticmethod
+    async def history_keys(stat):
+        """Returns the monthly rollup keys and daily keys for a stat, oldest first."""
+        keys = []
+        for pattern in (f"rollup.{stat}:????-??", f"daily.{stat}:????-??-??"):
+            keys += sorted(
+                [
+                    key.decode("utf-8")
+                    async for key in database.scan_iter(match=pattern, count=5000)
+                ]
             )
-        df = df.fillna(value=0).astype(int)
-        return df
-
-    async def convert_users(self, df):
-        """Converts discord user ids in DataFrames or Series indexes to usernames."""
-        current_ids = df.index
-        new_index = []
-        for user_id in current_ids:
-            user = await fetch_get_user(int(user_id), bot=self.bot, member=False)
+        return tuple(keys)
+
+    async def convert_users(self, rows):
+        """Converts discord user ids in rows to usernames."""
+        users = await fetch_get_users(
+            (int(user_id) for user_id, _ in rows), bot=self.bot
+        )
+        converted = []
+        for user_id, values in rows:
+            user = users[int(user_id)]
             if user is None:
-                new_index.append("User Unavailable")
+                converted.append(("User Unavailable", values))
             else:
-                new_index.append(f"{user.name}#{user.discriminator}")
-        df.index = new_index
-        return df
+                converted.append((f"{user.name}#{user.discriminator}", values))
+        return converted
 
     # give frequency stats
     @commands.hybrid_command(
@@ -180,36 +191,41 @@ class Stats(commands.Cog):
 
         elif topic == "scores":
             embed.description = "**Score Statistics**"
-            scores = self.generate_series("users:global")
-            scores = scores[scores > 0]
-            c, d = np.histogram(scores, bins=range(0, 1100, 100), range=(0, 1000))
-            c = (c / len(scores) * 100).round(1)
+            scores = [
+                score
+                for score in await self.generate_series("users:global")
+                if score > 0
+            ]  # already sorted from highest to lowest
+            # scores from 0-1000 in buckets of 100, the last bucket includes 1000
+            c = [0] * 10
+            for score in scores:
+                if score <= 1000:
+                    c[min(score // 100, 9)] += 1
+            c = [round(count / len(scores) * 100, 1) for count in c]
+            mean = statistics.mean(scores)
+            over_mean = sum(1 for score in scores if score > mean)
             embed.add_field(
                 name="Totals",
                 inline=False,
-                value="**Sum of top 10 user scores:** `{:,}`\n".format(
-                    scores.nlargest(n=10).sum()
-                )
-                + "**Sum of all positive user scores:** `{:,}`\n".format(scores.sum()),
+                value="**Sum of top 10 user scores:** `{:,}`\n".format(sum(scores[:10]))
+                + "**Sum of all positive user scores:** `{:,}`\n".format(sum(scores)),
             ).add_field(
                 name="Computations",
                 inline=False,
-                value="**Mean of all positive user scores:** `{:,.2f}`\n".format(
-                    scores.mean()
-                )
+                value="**Mean of all positive user scores:** `{:,.2f}`\n".format(mean)
                 + "**Median of all positive user scores:** `{:,.1f}`\n".format(
-                    scores.median()
+                    statistics.median(scores)
                 ),
             ).add_field(
                 name="Distributions",
                 inline=False,
-                value=f"**Number of users with scores over mean:** `{len(scores[scores > scores.mean()])}`\n"
+                value=f"**Number of users with scores over mean:** `{over_mean}`\n"
                 + "**Percentage of users with scores over mean:** `{:.1%}`".format(
-                    len(scores[scores > scores.mean()]) / len(scores)
+                    over_mean / len(scores)
                 )
                 + "\n**Percentage of users with scores between:**\n"
                 + "".join(
-                    f"\u2192 *{d[i]}-{d[i+1]-1}*: `{c[i]}%`\n"  # \u2192 is the "Rightwards Arrow"
+                    f"\u2192 *{i * 100}-{i * 100 + 99}*: `{c[i]}%`\n"  # \u2192 is the "Rightwards Arrow"
                     for i in range(len(c))
                 ),
             )
@@ -218,26 +234,21 @@ class Stats(commands.Cog):
             embed.description = "**Usage Statistics**"
 
             today = datetime.datetime.now(datetime.timezone.utc).date()
-            past_month = pd.date_range(  # pylint: disable=no-member
-                today - datetime.timedelta(29), today
-            ).date
+            past_month = tuple(
+                today - datetime.timedelta(days) for days in range(29, -1, -1)
+            )  # oldest first, today is last
             keys = ("users:global",) + tuple(
                 f"daily.score:{str(date)}" for date in past_month
             )
-            titles = tuple(
-                reversed(range(1, 32))
-            )  # label columns by # days ago, today is 1 day ago
-            month = self.generate_dataframe(keys, titles)
-            total = month.loc[:, 31]
-            month = month.loc[:, 30:1]  # remove totals column
-            month = month.loc[(month != 0).any(1)]  # remove users with all 0s
-            week = month.loc[:, 7:1]  # generate week from month
-            week = week.loc[(week != 0).any(1)]
-            today = week.loc[:, 1]  # generate today from week
-            today = today.loc[today != 0]
+            rows = [values for _, values in await self.generate_table(keys)]
+            total = [values[0] for values in rows]
+            # remove totals column and users with all 0s
+            month = [values[1:] for values in rows if any(values[1:])]
+            week = [values[-7:] for values in month if any(values[-7:])]
+            today = [values[-1] for values in week if values[-1]]
 
             channels_see = len(tuple(self.bot.get_all_channels()))
-            channels_used = int(database.zcard("score:global"))
+            channels_used = int(await database.zcard("score:global"))
 
             embed.add_field(
                 name="Today (Since midnight UTC)",
@@ -245,21 +256,21 @@ class Stats(commands.Cog):
                 value="**Accounts that answered at least 1 correctly:** `{:,}`\n".format(
                     len(today)
                 )
-                + f"**Total {config.options['id_type']} answered correctly:** `{today.sum():,}`\n",
+                + f"**Total {config.options['id_type']} answered correctly:** `{sum(today):,}`\n",
             ).add_field(
                 name="Last 7 Days",
                 inline=False,
                 value="**Accounts that answered at least 1 correctly:** `{:,}`\n".format(
                     len(week)
                 )
-                + f"**Total {config.options['id_type']} answered correctly:** `{week.sum().sum():,}`\n",
+                + f"**Total {config.options['id_type']} answered correctly:** `{sum(map(sum, week)):,}`\n",
             ).add_field(
                 name="Last 30 Days",
                 inline=False,
                 value="**Accounts that answered at least 1 correctly:** `{:,}`\n".format(
                     len(month)
                 )
-                + f"**Total {config.options['id_type']} answered correctly:** `{month.sum().sum():,}`\n",
+                + f"**Total {config.options['id_type']} answered correctly:** `{sum(map(sum, month)):,}`\n",
             ).add_field(
                 name="Total",
                 inline=False,
@@ -272,7 +283,8 @@ class Stats(commands.Cog):
                     len(total)
                 )
                 + "**Accounts that answered at least 1 correctly:** `{:,} ({:,.1%})`\n".format(
-                    len(total[total > 0]), len(total[total > 0]) / len(total)
+                    sum(1 for score in total if score > 0),
+                    sum(1 for score in total if score > 0) / len(total),
                 ),
             )
 
@@ -288,22 +300,15 @@ class Stats(commands.Cog):
         files = []
 
         async def _export_helper(database_keys, header, filename, users=False):
-            if not isinstance(database_keys, str) and len(database_keys) > 1:
-                data = self.generate_dataframe(
-                    database_keys, header.strip().split(",")[1:]
-                )
-            else:
-                key = (
-                    database_keys
-                    if isinstance(database_keys, str)
-                    else database_keys[0]
-                )
-                data = self.generate_series(key)
+            if isinstance(database_keys, str):
+                database_keys = (database_keys,)
+            data = await self.generate_table(database_keys)
             if users:
                 data = await self.convert_users(data)
             with StringIO() as f:
                 f.write(header)
-                data.to_csv(f, header=False)
+                writer = csv.writer(f, lineterminator="\n")
+                writer.writerows((member, *values) for member, values in data)
                 with BytesIO(f.getvalue().encode("utf-8")) as b:
                     files.append(discord.File(b, filename))
 
@@ -335,14 +340,7 @@ class Stats(commands.Cog):
         )
 
         logger.info("exporting missed")
-        keys = tuple(
-            sorted(
-                map(
-                    lambda x: x.decode("utf-8"),
-                    database.scan_iter(match="daily.incorrect:????-??-??", count=5000),
-                )
-            )
-        )
+        keys = await self.history_keys("incorrect")
         titles = ",".join(map(lambda x: x.split(":")[1], keys))
         keys = ("incorrect:global",) + keys
         await _export_helper(
@@ -353,14 +351,7 @@ class Stats(commands.Cog):
         )
 
         logger.info("exporting scores")
-        keys = tuple(
-            sorted(
-                map(
-                    lambda x: x.decode("utf-8"),
-                    database.scan_iter(match="daily.score:????-??-??", count=5000),
-                )
-            )
-        )
+        keys = await self.history_keys("score")
         titles = ",".join(map(lambda x: x.split(":")[1], keys))
         keys = ("users:global",) + keys
         await _export_helper(
@@ -38,14 +38,24 @@ web_required: Dict[str, Optional[str]] = {
 
 optional: Dict[str, Any] = {
     "members_intent": False,  # whether the privileged members intent is enabled in the developer portal
-    "download_func": None,  # asyncronous function that downloads images locally to download_dir
+    "download_func": None,  # asyncronous function that downloads images locally to download_dir, can return a list of directories that changed
     "refresh_images": True,  # whether to run download_func once every 24 hours with None as an argument
-    "evict_images": False,  # whether to delete items from download_dir
+    "evict_images": False,  # whether to delete the least recently used items from download_dir when it gets too large
     "evict_frequency": 5.0,  # how often to run eviction function
-    "evict_threshold": 10,  # the number of times a specimen is seen before eviction
-    "max_evict": 1,  # how many specimens to evict at a time
+    "evict_max_bytes": 2000000000,  # size of download_dir (in bytes) to keep under when evicting items
     "evict_func": None,  # async function to run during eviction
     "download_dir": "github_download/",  # local directory containing media (images)
+    "sparse_checkout": None,  # list of alternate lists or groups to check out from the image repo, other items are checked out when needed (None for everything)
+    "media_cache_dir": "media_cache/",  # local directory for converted media (black and white images)
+    "media_cache_size": 64,  # number of converted images to keep in memory
+    "warmup_items": 50,  # number of the most used items to read into memory when starting
+    "warmup_timeout": 30.0,  # max number of seconds to spend loading media when starting
+    "image_processes": 2,  # number of processes for image conversion, 0 to use a thread instead
+    "image_queue_size": 32,  # max number of image conversions waiting for the pool before new ones are rejected
+    "max_image_size": 4000000,  # images larger than this (in bytes) are downscaled before sending
+    "max_image_dimension": 2048,  # max width and height (in pixels) of downscaled images
+    "reuse_uploads": False,  # send images that were uploaded before by their discord url instead of uploading again
+    "upload_url_ttl": 72000,  # max number of seconds to reuse an upload url, discord urls expire after about a day
     "data_dir": "data/",  # local directory containing the id data
     "group_dir": "group/",  # directory within data_dir containing group lists
     "state_dir": "state/",  # directory within data_dir containing alternate lists
@@ -54,6 +64,7 @@ optional: Dict[str, Any] = {
     "wikipedia_file": "wikipedia.txt",  # filename within data_dir containing wiki urls for every item
     "prompt_file": None,  # filename within data_dir containing "close" answers that should be prompted on
     "meme_file": None,  # filename within data_dir containing memes to send
+    "data_cache_file": "data.pickle",  # file within bot_files_dir to cache parsed data for faster startup (None to disable)
     "logs": True,  # enable logging
     "log_dir": "logs/",  # directory for text logs/backups
     "bot_files_dir": "",  # folder for bot generated files (downloaded images, logs)
@@ -74,8 +85,19 @@ optional: Dict[str, Any] = {
     "bot_token_env": "token",  # name of environment variable containing the discord bot token
     "sentry_dsn_env": "SENTRY_DISCORD_DSN",  # name of environment variable containing the sentry dsn
     "redis_env": "REDIS_URL",  # name of environment variable containing the redis database url
+    "redis_max_connections": 50,  # size of the redis connection pool, commands wait for a free connection
+    "monthly_lb_ttl": 300,  # seconds to cache the totals for monthly leaderboards
+    "daily_retention_days": 90,  # daily stats older than this are combined into monthly totals, at least 30 (None to keep daily stats)
+    "user_cache_size": 10000,  # max number of discord users to keep cached
+    "user_cache_ttl": 21600,  # seconds before a cached discord user is looked up again
+    "user_warmer_rate": 5,  # max users fetched per second when warming the user cache, discord allows 50 requests per second
+    "user_warmer_concurrency": 3,  # max concurrent requests when warming the user cache
+    "user_warmer_active_days": 7,  # users who answered in this many days are warmed first
     "backups_channel": None,  # discord channel id to upload database backups (None/False to disable)
     "backups_dir": "backups/",  # directory to put database backup files before uploading
+    "backup_chunk_size": 8000000,  # approximate max size in bytes of each backup file, larger values get their own file
+    "backup_full_every": 24,  # make a full backup after this many backups, the rest only contain changes
+    "backup_upload_limit": 10000000,  # max total size in bytes of the backup files sent in one message (discord's upload limit), larger files are split
     "holidays": True,  # enable special features on select holidays
     "sendas": True,  # enable the "sendas" command
 }
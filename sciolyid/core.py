@@ -15,29 +15,683 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import asyncio
+import collections
+import hashlib
 import io
+import multiprocessing
 import os
-from functools import partial
-from typing import Union
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
 
 import discord
 
 import sciolyid.config as config
 import sciolyid.data
-from sciolyid.data import GenericError, database, get_category, logger
-from sciolyid.util import black_and_white
+from sciolyid.data import (
+    GenericError,
+    category_index,
+    database,
+    get_category,
+    logger,
+    master_id_list,
+)
+from sciolyid.util import black_and_white, resize_image
 
 # Valid file types
 valid_image_extensions = {"jpg", "png", "jpeg", "gif"}
 
 
-async def send_image(ctx, item: str, on_error=None, message=None, bw=False):
+class MediaFile(NamedTuple):
+    path: str
+    extension: str
+    size: int
+    mtime: int
+
+
+def _scan_directory(directory: str) -> List[MediaFile]:
+    """Returns the files in a directory, sorted by name."""
+    try:
+        with os.scandir(directory) as entries:
+            files = []
+            for entry in entries:
+                if entry.is_file():
+                    stat_info = entry.stat()
+                    files.append(
+                        MediaFile(
+                            entry.path,
+                            entry.name.split(".")[-1],
+                            stat_info.st_size,
+                            stat_info.st_mtime_ns,
+                        )
+                    )
+    except FileNotFoundError:
+        return []
+    files.sort()
+    return files
+
+
+def _scan_all(download_dir: str) -> Dict[str, List[MediaFile]]:
+    """Returns the files in every item directory of `download_dir`."""
+    index = {}
+    try:
+        with os.scandir(download_dir) as categories:
+            category_names = [
+                entry.name
+                for entry in categories
+                if entry.is_dir() and not entry.name.startswith(".")
+            ]
+    except FileNotFoundError:
+        return index
+    for category in category_names:
+        with os.scandir(f"{download_dir}{category}") as items:
+            item_names = [entry.name for entry in items if entry.is_dir()]
+        for item in item_names:
+            directory = f"{download_dir}{category}/{item}/"
+            index[directory] = _scan_directory(directory)
+    return index
+
+
+class MediaIndex:
+    """In-memory index of the files in each item directory.
+
+    Listing and checking files on every picture is slow when the media
+    is on network storage, so files are scanned once and kept in memory.
+    The whole index is rebuilt after `download_func` syncs everything,
+    and single directories are scanned the first time they're needed or
+    after they're downloaded or evicted.
+    """
+
+    def __init__(self):
+        self._directories: Dict[str, List[MediaFile]] = {}
+
+    def get(self, directory: str) -> Optional[List[MediaFile]]:
+        """Returns the indexed files in `directory`, or None if it isn't indexed."""
+        return self._directories.get(directory)
+
+    def all_files(self) -> Iterator[MediaFile]:
+        """Yields every indexed file."""
+        for files in self._directories.values():
+            yield from files
+
+    def directory_sizes(self) -> Dict[str, int]:
+        """Returns the total size of the indexed files in each directory."""
+        return {
+            directory: sum(media.size for media in files)
+            for directory, files in self._directories.items()
+        }
+
+    def discard(self, directory: str):
+        """Removes `directory` from the index so it's scanned again when needed."""
+        self._directories.pop(directory, None)
+
+    async def scan(self, directory: str) -> List[MediaFile]:
+        """Scans a single directory and updates the index."""
+        loop = asyncio.get_running_loop()
+        files = await loop.run_in_executor(None, _scan_directory, directory)
+        self._directories[directory] = files
+        return files
+
+    async def scan_many(self, directories: Iterable[str]):
+        """Scans several directories and updates the index."""
+        directories = list(directories)
+        loop = asyncio.get_running_loop()
+        files = await loop.run_in_executor(
+            None, lambda: [_scan_directory(directory) for directory in directories]
+        )
+        self._directories.update(zip(directories, files))
+
+    async def refresh(self):
+        """Rebuilds the index from everything in `download_dir`."""
+        logger.info("refreshing media index")
+        loop = asyncio.get_running_loop()
+        self._directories = await loop.run_in_executor(
+            None, _scan_all, config.options["download_dir"]
+        )
+        logger.info(f"indexed {len(self._directories)} directories")
+
+
+media_index = MediaIndex()
+
+
+class MediaUsage:
+    """Tracks when item directories are used, for evicting unused items.
+
+    The directories last sent to each channel and user are remembered,
+    so items in active races and sessions can be kept.
+    """
+
+    def __init__(self):
+        self.last_used: Dict[str, float] = {}
+        # current and prefetched directories of each channel
+        self._channels: Dict[int, collections.deque] = {}
+        self._users: Dict[int, str] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.evicted_bytes = 0
+
+    def record(self, ctx, directory: str):
+        """Records that `directory` was used in a channel."""
+        self.last_used[directory] = time.time()
+        self._channels.setdefault(
+            ctx.channel.id, collections.deque(maxlen=2)
+        ).append(directory)
+        self._users[ctx.author.id] = directory
+
+    def record_eviction(self, directory: str, size: int):
+        self.last_used.pop(directory, None)
+        self.evicted += 1
+        self.evicted_bytes += size
+
+    async def pinned(self) -> set:
+        """Returns directories used by channels with races or users with sessions.
+
+        Channels and users without races or sessions are forgotten.
+        """
+        channels = list(self._channels.keys())
+        users = list(self._users.keys())
+        pipe = database.pipeline()
+        for channel_id in channels:
+            pipe.exists(f"race.data:{channel_id}")
+        for user_id in users:
+            pipe.exists(f"session.data:{user_id}")
+        results = await pipe.execute()
+
+        pinned = set()
+        for channel_id, active in zip(channels, results[: len(channels)]):
+            if active:
+                pinned.update(self._channels[channel_id])
+            else:
+                del self._channels[channel_id]
+        for user_id, active in zip(users, results[len(channels) :]):
+            if active:
+                pinned.add(self._users[user_id])
+            else:
+                del self._users[user_id]
+        return pinned
+
+    def stats(self) -> dict:
+        """Returns cache hit, miss, and eviction counts."""
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evicted": self.evicted,
+            "evicted_bytes": self.evicted_bytes,
+        }
+
+
+media_usage = MediaUsage()
+
+
+class ImagePool:
+    """Bounded pool for image processing.
+
+    Image conversions hold the GIL, so they run in a separate process
+    pool instead of the default executor. At most `image_processes`
+    conversions are submitted at once, others wait their turn, and new
+    ones are rejected when more than `image_queue_size` are waiting.
+
+    The worker processes are forked by `start()`, which must be called
+    while the process only has one thread. If the pool isn't started,
+    conversions run in a thread instead.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.peak_waiting = 0
+        self.total_wait = 0.0
+
+    def start(self):
+        """Forks the pool's worker processes.
+
+        Forking a process with other threads running can deadlock,
+        so this must be called before the event loop or discord.py
+        start any threads.
+        """
+        if self._executor is not None:
+            return
+        workers = config.options["image_processes"]
+        if workers <= 0:
+            return
+        # bots usually start without an `if __name__ == "__main__"` guard,
+        # so only fork is safe since other start methods import __main__
+        if "fork" not in multiprocessing.get_all_start_methods():
+            logger.info("fork is not available, not starting image processes")
+            return
+        if threading.active_count() > 1:
+            logger.warning("other threads are running, not starting image processes")
+            return
+
+        logger.info(f"starting image pool with {workers} processes")
+        self._executor = ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("fork")
+        )
+        # all workers are forked on the first submit, before the pool
+        # starts its management thread
+        self._executor.submit(int).result()
+
+    def _get_executor(self):
+        if self._executor is None:
+            logger.info("starting image pool with a thread")
+            self._executor = ThreadPoolExecutor(1, thread_name_prefix="image")
+        return self._executor
+
+    def shutdown(self):
+        """Stops the pool's workers."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        """Returns queue depth and throughput metrics."""
+        return {
+            "waiting": self.waiting,
+            "running": self.running,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "peak_waiting": self.peak_waiting,
+            "average_wait": self.total_wait / self.completed if self.completed else 0.0,
+        }
+
+    async def run(self, func, *args):
+        """Runs `func(*args)` in the pool and returns the result.
+
+        `func` and its arguments must be picklable.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(max(config.options["image_processes"], 1))
+        if self.waiting >= config.options["image_queue_size"]:
+            self.rejected += 1
+            logger.info(f"image pool full: {self.stats()}")
+            raise GenericError("Too many images are being processed", code=429)
+
+        self.waiting += 1
+        self.peak_waiting = max(self.peak_waiting, self.waiting)
+        queued_at = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.running += 1
+        self.total_wait += time.perf_counter() - queued_at
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self.running -= 1
+            self.completed += 1
+            self._slots.release()
+            logger.info(f"image pool: {self.stats()}")
+
+
+image_pool = ImagePool()
+
+
+class MediaCache:
+    """Cache of converted versions of media files.
+
+    Converted files are saved in `media_cache_dir` and the most recently
+    used ones are also kept in memory. Files are keyed by their path and
+    modification time, so a file that changes after a sync is converted
+    again. Concurrent requests for the same file share one conversion.
+    `prune()` deletes converted files that aren't in the media index
+    anymore, and `discard()` deletes the converted files of specific
+    media.
+
+    `name` (str) - subdirectory of `media_cache_dir` to use\n
+    `convert` (function) - function that takes a path and returns a file object\n
+    `extension` (str) - extension of the converted files\n
+    """
+
+    def __init__(self, name: str, convert, extension: str):
+        self.name = name
+        self.convert = convert
+        self.extension = extension
+        self._memory: collections.OrderedDict = collections.OrderedDict()
+        self._on_disk: Optional[set] = None
+        self._pending: Dict[str, asyncio.Task] = {}  # filename -> conversion task
+
+    @property
+    def directory(self) -> str:
+        return f"{config.options['media_cache_dir']}{self.name}/"
+
+    def _key(self, media: MediaFile) -> str:
+        return hashlib.sha1(f"{media.path}:{media.mtime}".encode()).hexdigest()
+
+    def _list_disk(self) -> set:
+        os.makedirs(self.directory, exist_ok=True)
+        return set(os.listdir(self.directory))
+
+    async def load(self):
+        """Lists the converted files on disk if they haven't been listed yet."""
+        if self._on_disk is None:
+            loop = asyncio.get_running_loop()
+            self._on_disk = await loop.run_in_executor(None, self._list_disk)
+
+    def _read(self, filename: str) -> bytes:
+        with open(f"{self.directory}{filename}", "rb") as f:
+            return f.read()
+
+    def _write(self, filename: str, data: bytes):
+        tmp_path = f"{self.directory}{filename}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, f"{self.directory}{filename}")
+
+    def _remember(self, filename: str, data: bytes):
+        self._memory[filename] = data
+        self._memory.move_to_end(filename)
+        while len(self._memory) > config.options["media_cache_size"]:
+            self._memory.popitem(last=False)
+
+    async def _load_file(self, media: MediaFile, filename: str) -> bytes:
+        loop = asyncio.get_running_loop()
+        await self.load()
+        if filename in self._on_disk:
+            logger.info(f"{self.name} cache: disk hit")
+            data = await loop.run_in_executor(None, self._read, filename)
+        else:
+            logger.info(f"{self.name} cache: converting")
+            converted = await image_pool.run(self.convert, media.path)
+            data = converted.getvalue()
+            await loop.run_in_executor(None, self._write, filename, data)
+            self._on_disk.add(filename)
+        self._remember(filename, data)
+        return data
+
+    async def get(self, media: MediaFile) -> io.BytesIO:
+        """Returns the converted version of `media`, converting it if needed."""
+        filename = f"{self._key(media)}.{self.extension}"
+        data = self._memory.get(filename)
+        if data is not None:
+            logger.info(f"{self.name} cache: memory hit")
+            self._memory.move_to_end(filename)
+            return io.BytesIO(data)
+
+        task = self._pending.get(filename)
+        if task is None:
+            task = asyncio.ensure_future(self._load_file(media, filename))
+            self._pending[filename] = task
+            task.add_done_callback(lambda _: self._pending.pop(filename, None))
+        # don't cancel the conversion for other waiters if this one is cancelled
+        return io.BytesIO(await asyncio.shield(task))
+
+    def _prune(self, keep: set) -> set:
+        on_disk = self._list_disk()
+        self._remove(on_disk - keep)
+        return on_disk & keep
+
+    def _remove(self, filenames: set):
+        for filename in filenames:
+            try:
+                os.remove(f"{self.directory}{filename}")
+            except FileNotFoundError:
+                pass
+
+    async def discard(self, media: Iterable[MediaFile]):
+        """Deletes the converted files of `media`."""
+        filenames = {f"{self._key(file)}.{self.extension}" for file in media}
+        if not filenames:
+            return
+        for filename in filenames & set(self._memory):
+            del self._memory[filename]
+        if self._on_disk is not None:
+            self._on_disk -= filenames
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._remove, filenames)
+        logger.info(f"{self.name} cache: {len(filenames)} files discarded")
+
+    async def prune(self):
+        """Deletes converted files of media that isn't in the media index.
+
+        This should only be run when the whole index was just rebuilt,
+        since converted files of directories that aren't indexed are
+        deleted too.
+        """
+        keep = {
+            f"{self._key(media)}.{self.extension}" for media in media_index.all_files()
+        }
+        for filename in set(self._memory) - keep:
+            del self._memory[filename]
+        loop = asyncio.get_running_loop()
+        self._on_disk = await loop.run_in_executor(None, self._prune, keep)
+        logger.info(f"{self.name} cache: {len(self._on_disk)} files kept")
+
+
+def _black_and_white(path: str) -> io.BytesIO:
+    final_buffer = black_and_white(path)
+    if final_buffer.getbuffer().nbytes < config.options["max_image_size"]:
+        return final_buffer
+    return resize_image(
+        path,
+        config.options["max_image_size"],
+        config.options["max_image_dimension"],
+        grayscale=True,
+    )
+
+
+def _resize(path: str) -> io.BytesIO:
+    return resize_image(
+        path, config.options["max_image_size"], config.options["max_image_dimension"]
+    )
+
+
+bw_cache = MediaCache("bw", _black_and_white, "png")
+resize_cache = MediaCache("resized", _resize, "jpg")
+
+
+def item_directory(category: str, item: str) -> str:
+    return f"{config.options['download_dir']}{category}/{item.lower()}/"
+
+
+async def download_media(category: Optional[str], item: Optional[str]):
+    """Runs `download_func` and updates the media index.
+
+    If `download_func` returns a list of directories that changed,
+    only those directories are scanned again.
+
+    `category` (str) - category of the item, or None for everything\n
+    `item` (str) - item to download, or None for everything\n
+    """
+    changed = await config.options["download_func"](sciolyid.data, category, item)
+    if changed is None and item is not None:
+        await media_index.scan(item_directory(category, item))
+        return
+
+    if changed is None:
+        await media_index.refresh()
+        await bw_cache.prune()
+        await resize_cache.prune()
+        return
+
+    changed = set(changed)
+    if item is not None:
+        changed.add(item_directory(category, item))
+    logger.info(f"updating {len(changed)} directories in media index")
+    # only converted files of the changed directories can be stale
+    before = {
+        media for directory in changed for media in media_index.get(directory) or ()
+    }
+    await media_index.scan_many(changed)
+    stale = before.difference(
+        *(media_index.get(directory) or () for directory in changed)
+    )
+    await bw_cache.discard(stale)
+    await resize_cache.discard(stale)
+
+
+async def _preload_items():
+    """Reads the most used images so they're in the OS page cache."""
+    items = [
+        item.decode("utf-8").lower()
+        for item in await database.zrevrange(
+            "frequency.item:global", 0, config.options["warmup_items"] - 1
+        )
+    ]
+    paths = [
+        media.path
+        for item in items
+        for media in media_index.get(item_directory(get_category(item), item)) or ()
+    ]
+    logger.info(f"warmup: reading {len(paths)} files")
+    loop = asyncio.get_running_loop()
+    reads = asyncio.Semaphore(4)
+
+    async def preload(path: str):
+        async with reads:
+            await loop.run_in_executor(None, _preload_file, path)
+
+    await asyncio.gather(*map(preload, paths))
+    logger.info("warmup: done reading files")
+
+
+async def _check_items():
+    """Checks that every item has images, and downloads them if none do."""
+    missing = [
+        item
+        for item in master_id_list
+        if not media_index.get(item_directory(category_index.get(item), item))
+    ]
+    if not missing:
+        logger.info("warmup: all items have images")
+        return
+    logger.info(f"warmup: {len(missing)} items have no images: {missing[:10]}")
+    if len(missing) == len(master_id_list):
+        logger.info("warmup: downloading images")
+        await download_media(None, None)
+
+
+async def warmup():
+    """Loads media before the bot starts handling commands.
+
+    Builds the media index and then, at the same time, reads the
+    `warmup_items` most used items into the page cache, lists the
+    converted images, and checks that every item has images. Anything
+    not finished after `warmup_timeout` seconds is left to happen
+    when it's needed.
+    """
+    start = time.perf_counter()
+
+    async def _warmup():
+        await media_index.refresh()
+        await asyncio.gather(
+            _preload_items(), _check_items(), bw_cache.load(), resize_cache.load()
+        )
+
+    try:
+        await asyncio.wait_for(_warmup(), timeout=config.options["warmup_timeout"])
+    except asyncio.TimeoutError:
+        logger.info("warmup timed out")
+    logger.info(f"warmup took {time.perf_counter() - start:.2f} seconds")
+
+
+def _upload_key(media: MediaFile, bw: bool) -> str:
+    return f"media.url:{'bw' if bw else 'color'}:{media.path}:{media.mtime}"
+
+
+async def _remember_upload(media: MediaFile, bw: bool, url: str):
+    """Saves the url of an uploaded image so it can be sent again."""
+    ttl = config.options["upload_url_ttl"]
+    # discord attachment urls are signed with an expiry time in hex
+    expires = urllib.parse.parse_qs(urllib.parse.urlparse(url).query).get("ex")
+    if expires:
+        try:
+            # leave some time for the url to be used
+            ttl = min(ttl, int(expires[0], 16) - round(time.time()) - 3600)
+        except ValueError:
+            pass
+    if ttl > 0:
+        await database.set(_upload_key(media, bw), url, ex=ttl)
+
+
+class PreparedMedia(NamedTuple):
+    item: str
+    media: MediaFile
+    file_stream: Optional[Union[str, io.BufferedIOBase]]
+    extension: str
+
+
+def _preload_file(path: str):
+    """Loads a file into the OS page cache without keeping it in memory."""
+    with open(path, "rb") as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_WILLNEED)
+            return
+        while f.read(1 << 20):
+            pass
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def load_media(
+    media: MediaFile, bw: bool = False, read: bool = False
+) -> Tuple[Union[str, io.BufferedIOBase], str]:
+    """Returns the file (or path) to upload for `media`, and its extension.
+
+    `media` (MediaFile) - file to load\n
+    `bw` (bool) - whether to convert the image to black and white\n
+    `read` (bool) - whether to read unconverted files into memory instead of returning the path\n
+    """
+    if bw:
+        return await bw_cache.get(media), media.extension
+    if media.size > config.options["max_image_size"]:
+        # downscale large files instead of uploading the original
+        return await resize_cache.get(media), "jpg"
+    if read:
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, _read_file, media.path)
+        return io.BytesIO(data), media.extension
+    return media.path, media.extension
+
+
+async def prepare_media(ctx, item: str, bw: bool = False) -> PreparedMedia:
+    """Chooses and loads an image ahead of time.
+
+    The result can be passed to send_image() to send it without waiting.
+
+    `ctx` - Discord context object\n
+    `item` (str) - item to get image of\n
+    `bw` (bool) - whether to convert the image to black and white\n
+    """
+    media = await get_image(ctx, item)
+    if config.options["reuse_uploads"] and await database.exists(
+        _upload_key(media, bw)
+    ):
+        # the image will be sent by url, so there's nothing to load
+        return PreparedMedia(item, media, None, media.extension)
+    file_stream, extension = await load_media(media, bw, read=True)
+    return PreparedMedia(item, media, file_stream, extension)
+
+
+async def send_image(
+    ctx,
+    item: str,
+    on_error=None,
+    message=None,
+    bw=False,
+    prepared: Optional[PreparedMedia] = None,
+):
     """Gets a picture and sends it to the user.
 
     `ctx` - Discord context object\n
     `item` (str) - picture to send\n
     `on_error` (function) - async function to run when an error occurs, passes error as argument\n
     `message` (str) - text message to send before picture\n
+    `prepared` (PreparedMedia) - image loaded by prepare_media() to send instead\n
     """
     if item == "":
         logger.error(f"error - {config.options['id_type'][:-1]} is blank")
@@ -53,63 +707,84 @@ async def send_image(ctx, item: str, on_error=None, message=None, bw=False):
         # trigger "typing" discord message
         await ctx.typing()
 
-    try:
-        response = await get_image(ctx, item)
-    except GenericError as e:
-        if ctx.interaction is None:
-            await delete.delete()
-        if e.code == 100:
-            await ctx.send("**No images were found.**")
-        else:
+    if prepared is not None:
+        response = prepared.media
+    else:
+        try:
+            response = await get_image(ctx, item)
+        except GenericError as e:
+            if ctx.interaction is None:
+                await delete.delete()
+            if e.code == 100:
+                await ctx.send("**No images were found.**")
+            else:
+                await ctx.send(
+                    f"**An error has occurred while fetching images.**\n**Reason:** {e}"
+                )
+            logger.exception(e)
+            if on_error is not None:
+                await on_error(e)
+            else:
+                await ctx.send("*Please try again.*")
+            return
+
+    filename = response.path
+    cached_url = None
+    if config.options["reuse_uploads"]:
+        cached_url = await database.get(_upload_key(response, bw))
+
+    if cached_url is None:
+        try:
+            if prepared is not None and prepared.file_stream is not None:
+                file_stream, extension = prepared.file_stream, prepared.extension
+            else:
+                file_stream, extension = await load_media(response, bw)
+            # change filename to avoid spoilers
+            file_obj = discord.File(file_stream, filename=f"image.{extension}")
+        except (FileNotFoundError, GenericError) as e:
+            if isinstance(e, FileNotFoundError):
+                # the file was deleted since it was indexed
+                media_index.discard(os.path.dirname(filename) + "/")
+                e = GenericError("File Not Found", code=999)
+            if ctx.interaction is None:
+                await delete.delete()
             await ctx.send(
                 f"**An error has occurred while fetching images.**\n**Reason:** {e}"
             )
-        logger.exception(e)
-        if on_error is not None:
-            await on_error(e)
-        else:
-            await ctx.send("*Please try again.*")
-        return
+            logger.exception(e)
+            if on_error is not None:
+                await on_error(e)
+            else:
+                await ctx.send("*Please try again.*")
+            return
 
-    filename = str(response[0])
-    extension = str(response[1])
-    stat_info = os.stat(filename)
-    if stat_info.st_size > 4000000:  # another filesize check (4mb)
-        if ctx.interaction is None:
-            await delete.delete()
-        await ctx.send(
-            "**Oops! File too large :(**\n*Please try again.*", ephemeral=True
-        )
-    else:
-        file_stream: Union[str, io.BufferedIOBase]
-        if bw:
-            # prevent the black and white conversion from blocking
-            loop = asyncio.get_running_loop()
-            fn = partial(black_and_white, filename)
-            file_stream = await loop.run_in_executor(None, fn)
-        else:
-            file_stream = filename
+    if message is not None:
+        await ctx.send(message)
 
-        if message is not None:
-            await ctx.send(message)
+    if config.options["hooks"]["before_media_send"]:
+        await config.options["hooks"]["before_media_send"](ctx, item, filename)
 
-        if config.options["hooks"]["before_media_send"]:
-            await config.options["hooks"]["before_media_send"](ctx, item, filename)
-
-        # change filename to avoid spoilers
-        file_obj = discord.File(file_stream, filename=f"image.{extension}")
-        await ctx.send(file=file_obj)
-        if ctx.interaction is None:
-            await delete.delete()
+    if cached_url is not None:
+        logger.info("sending uploaded image url")
+        embed = discord.Embed(type="rich", colour=discord.Color.blurple())
+        embed.set_image(url=cached_url.decode("utf-8"))
+        await ctx.send(embed=embed)
+    else:
+        sent = await ctx.send(file=file_obj)
+        if config.options["reuse_uploads"] and sent is not None and sent.attachments:
+            await _remember_upload(response, bw, sent.attachments[0].url)
+    if ctx.interaction is None:
+        await delete.delete()
 
 
 async def get_image(ctx, item):
     """Chooses an image from a list of images.
 
     This function chooses a valid image to pass to send_image().
-    Valid images are based on file extension and size. (8mb discord limit)
+    Valid images are based on file extension. Large images are
+    downscaled by send_image().
 
-    Returns a list containing the file path and extension type.
+    Returns a MediaFile with the file path, extension type, and size.
 
     `ctx` - Discord context object\n
     `item` (str) - item to get image of\n
@@ -117,7 +792,9 @@ async def get_image(ctx, item):
 
     images = await get_files(item)
     logger.info("images: " + str(images))
-    prevJ = int(database.hget(f"channel:{ctx.channel.id}", "prevJ").decode("utf-8"))
+    prevJ = int(
+        (await database.hget(f"channel:{ctx.channel.id}", "prevJ")).decode("utf-8")
+    )
     # Randomize start (choose beginning 4/5ths in case it fails checks)
     if images:
         j = (prevJ + 1) % len(images)
@@ -125,35 +802,30 @@ async def get_image(ctx, item):
         logger.info("j: " + str(j))
 
         valid = False
-        for x in range(0, len(images)):  # check file type and size
+        for x in range(0, len(images)):  # check file type
             y = (x + j) % len(images)
-            image_link = images[y]
-            extension = image_link.split(".")[-1]
-            logger.info("extension: " + str(extension))
-            stat_info = os.stat(image_link)
-            logger.info("size: " + str(stat_info.st_size))
-            if (
-                extension.lower() in valid_image_extensions
-                and stat_info.st_size < 4000000  # keep files less than 4mb
-            ):
+            image = images[y]
+            logger.info("extension: " + str(image.extension))
+            if image.extension.lower() in valid_image_extensions:
                 logger.info("found one!")
                 valid = True
+                media_usage.record(ctx, os.path.dirname(image.path) + "/")
                 break
         if not valid:
             raise GenericError("No Valid Images Found", code=999)
 
-        database.hset(f"channel:{ctx.channel.id}", "prevJ", str(j))
+        await database.hset(f"channel:{ctx.channel.id}", "prevJ", str(j))
     else:
         raise GenericError("No Images Found", code=100)
 
-    return [image_link, extension]
+    return image
 
 
 async def get_files(item, retries=0):
-    """Returns a list of image/song filenames.
+    """Returns a list of image/song files.
 
     This function also does cache management,
-    looking for files in the cache for media and
+    looking for files in the media index and
     downloading images to the cache if not found.
 
     `item` (str) - item to get image of\n
@@ -162,24 +834,27 @@ async def get_files(item, retries=0):
     logger.info(f"get_files retries: {retries}")
     item = str(item).lower()
     category = get_category(item)
-    directory = f"{config.options['download_dir']}{category}/{item}/"
-    try:
-        logger.info("trying")
-        logger.info(f"looking in: {directory}")
-        files_dir = os.listdir(directory)
-        if not files_dir:
-            logger.info("no files in directory")
-            raise GenericError("No Files", code=100)
+    directory = item_directory(category, item)
+    logger.info(f"looking in: {directory}")
+    files = media_index.get(directory)
+    if files is None:
+        logger.info("not indexed, scanning")
+        files = await media_index.scan(directory)
+    if files:
         logger.info("files found!")
-        return [f"{directory}{path}" for path in sorted(files_dir)]
-    except (FileNotFoundError, GenericError):
-        # if not found, fetch images
-        logger.info("fetching files")
-        logger.info("item: " + str(item))
-        if retries < 3:
-            retries += 1
-            await asyncio.sleep(1.5**retries)
-            await config.options["download_func"](sciolyid.data, category, item)
-            return await get_files(item, retries)
-        logger.info("More than 3 retries")
-        return []
+        if retries == 0:
+            media_usage.hits += 1
+        return files
+
+    # if not found, fetch images
+    logger.info("no files in directory, fetching files")
+    if retries == 0:
+        media_usage.misses += 1
+    logger.info("item: " + str(item))
+    if retries < 3:
+        retries += 1
+        await asyncio.sleep(1.5**retries)
+        await download_media(category, item)
+        return await get_files(item, retries)
+    logger.info("More than 3 retries")
+    return []
@@ -20,11 +20,12 @@ import itertools
 import logging
 import logging.handlers
 import os
+import pickle
 import shutil
 import sys
 
 import discord
-import redis
+import redis.asyncio
 import sentry_sdk
 from discord import app_commands
 from discord.ext import commands
@@ -33,14 +34,24 @@ from sentry_sdk.integrations.redis import RedisIntegration
 
 from sciolyid import config
 from sciolyid.downloads import download_github, download_logger
+from sciolyid.util import FuzzyMatcher
 
-# define database for one connection
+# define database with a shared connection pool
 if config.options["local_redis"]:
-    database = redis.Redis(host="localhost", port=6379, db=0)
+    _redis_pool = redis.asyncio.BlockingConnectionPool(
+        host="localhost",
+        port=6379,
+        db=0,
+        max_connections=config.options["redis_max_connections"],
+    )
 elif config.options["redis_env"] is not None:
-    database = redis.from_url(os.getenv(config.options["redis_env"]))
+    _redis_pool = redis.asyncio.BlockingConnectionPool.from_url(
+        os.getenv(config.options["redis_env"]),
+        max_connections=config.options["redis_max_connections"],
+    )
 else:
     raise ValueError("redis_env must be set if local_redis is False")
+database = redis.asyncio.Redis(connection_pool=_redis_pool)
 
 
 def before_sentry_send(event, hint):
@@ -105,8 +116,20 @@ if config.options["sentry"]:
 # leaderboard format = {
 #    users:global : [user id, # of correct]
 #    users.server.id:guild_id : [user id ... ]
+#    users.server.score:guild_id : [user id, # of correct in the server]
 # }
 
+# user cache warmer format:
+#   user_warmer:global : {
+#       total: # of users in the current pass
+#       warmed/cached/missing: # of users fetched, already cached, or not found
+#       started/updated: unix timestamps
+#   }
+#   user_warmer.queue:global : [user id, ...] (users left in the current pass)
+
+# completed data migrations:
+#   migrations:global : { migration name, ... }
+
 # streaks format = {
 #    streak:global : [user id, current streak]
 #    streak.max:global : [user id, max streak]
@@ -126,10 +149,6 @@ if config.options["sentry"]:
 #   frequency.item:global : [item name, # displayed]
 # }
 
-# last refresh frequency format = {
-#   frequency.item.refresh:global : [item name, # displayed]
-# }
-
 # command frequency format = {
 #   frequency.command:global : [command, # used]
 # }
@@ -144,6 +163,16 @@ if config.options["sentry"]:
 #     daily.incorrect:YYYY-MM-DD : [item name, # incorrect today]
 # }
 
+# monthly rollup format (daily keys older than daily_retention_days) = {
+#     rollup.score:YYYY-MM : [user id, # correct in month]
+#     rollup.incorrect:YYYY-MM : [item name, # incorrect in month]
+# }
+
+# monthly leaderboard cache format (expires after monthly_lb_ttl) = {
+#     monthly.score:YYYY-MM-DD : [user id, # correct in the 30 days ending on date]
+#     monthly.incorrect:YYYY-MM-DD : [item name, # incorrect in the 30 days ending on date]
+# }
+
 # ban format:
 #   banned:global : [user id, 0]
 
@@ -221,6 +250,7 @@ class GenericError(commands.CommandError):
         100 - Blank
         842 - Banned User
         666 - No output error
+        429 - Too busy
     """
 
     def __init__(self, message=None, code=0):
@@ -237,6 +267,7 @@ class GenericError(commands.CommandError):
 # 100 - Blank
 # 842 - Banned User
 # 666 - No output error
+# 429 - Too busy
 
 
 def _wiki_urls():
@@ -251,11 +282,13 @@ def _wiki_urls():
 
 
 # if custom lists are implemented then port https://github.com/tctree333/Bird-ID/pull/290/
-def format_wiki_url(ctx, item: str):
+async def format_wiki_url(ctx, item: str):
     logger.info("fetching wiki url")
-    if database.hget(f"session.data:{ctx.author.id}", "wiki") == b"" or database.exists(
-        f"race.data:{ctx.channel.id}"
-    ):
+    pipe = database.pipeline()
+    pipe.hget(f"session.data:{ctx.author.id}", "wiki")
+    pipe.exists(f"race.data:{ctx.channel.id}")
+    wiki, race = await pipe.execute()
+    if wiki == b"" or race:
         logger.info("disabling preview")
         return f"<{wikipedia_urls[item.lower()]}>"
     return wikipedia_urls[item.lower()]
@@ -306,25 +339,17 @@ def get_aliases(item: str):
 def get_category(item: str):
     logger.info(f"getting category for item {item}")
     item = item.lower()
-    for group in groups:
-        if item in groups[group]:
-            logger.info(f"category found: {group}")
-            return group.lower()
+    group = category_index.get(item)
+    if group is not None:
+        logger.info(f"category found: {group}")
+        return group.lower()
     logger.info(f"no category found for item {item}")
     return None
 
 
 def dealias_group(group):
     """Resolve group to a real category by expanding aliases."""
-    if group not in all_categories:
-        return None
-    if group in groups.keys():
-        return group
-    return next(
-        key
-        for key, value in config.options["category_aliases"].items()
-        if group in value
-    )
+    return category_alias_index.get(group)
 
 
 def _groups():
@@ -337,6 +362,7 @@ def _groups():
     # Converts txt file of data into lists
     lists = {}
     aliases_ = {}
+    index = {}  # item -> category
     for filename, category_name in filenames:
         logger.info(f"Working on {filename}")
         lists[category_name] = []
@@ -344,12 +370,13 @@ def _groups():
             for line in f:
                 line = tuple(map(lambda x: x.strip().lower(), line.split(",")))
                 lists[category_name].append(line[0])
+                index.setdefault(line[0], category_name)
                 if len(line) > 1:
                     aliases_[line[0]] = line
                     logger.info(f"Done with {filename}")
 
     logger.info("Done with lists!")
-    return (lists, aliases_)
+    return (lists, aliases_, index)
 
 
 def _state_lists():
@@ -401,11 +428,11 @@ def _memes():
     return []
 
 
-def _all_lists():
+def _all_lists(states_):
     """Compiles lists into master lists."""
     logger.info("Working on master lists")
     master = []
-    for state in states.values():
+    for state in states_.values():
         master += state["list"]
     master = tuple(set(master))
     logger.info("Done with master lists!")
@@ -436,24 +463,134 @@ def _config():
         config.options["evict_func"] = evict
 
 
-groups, aliases = _groups()
-states = _state_lists()
-prompts = _prompt()
-meme_list = _memes()
-master_id_list = _all_lists()
-wikipedia_urls = _wiki_urls()
+# increment if the format of the parsed data changes
+_SNAPSHOT_VERSION = 1
+
+
+def _source_files():
+    """Returns the path, size, and mtime of every data file.
+
+    This is used as the key for the data snapshot, so any change to the
+    data files causes the snapshot to be rebuilt.
+    """
+    paths = [
+        f"{config.options['group_dir']}{name}"
+        for name in os.listdir(config.options["group_dir"])
+    ]
+    for state in os.listdir(config.options["state_dir"]):
+        paths += [
+            f"{config.options['state_dir']}/{state}/{filename}.txt"
+            for filename in ("list", "aliases")
+        ]
+    paths += [
+        config.options[item]
+        for item in ("prompt_file", "meme_file", "wikipedia_file")
+        if config.options[item]
+    ]
+    files = []
+    for path in sorted(paths):
+        stat = os.stat(path)
+        files.append((path, stat.st_size, stat.st_mtime_ns))
+    return (_SNAPSHOT_VERSION, tuple(files))
+
+
+def _load_data():
+    """Loads the parsed data from the snapshot, or parses the data files.
+
+    If the snapshot is missing or out of date, the data files are parsed
+    and a new snapshot is written.
+    """
+    snapshot_file = config.options["data_cache_file"]
+    if not snapshot_file:
+        return _parse_data()
+
+    key = _source_files()
+    try:
+        with open(snapshot_file, "rb") as f:
+            snapshot = pickle.load(f)
+        if snapshot["key"] == key:
+            logger.info("Loaded data from snapshot")
+            return snapshot["data"]
+        logger.info("Data snapshot is out of date")
+    except FileNotFoundError:
+        logger.info("No data snapshot found")
+    except (pickle.UnpicklingError, EOFError, KeyError, TypeError, ValueError):
+        logger.info("Data snapshot is corrupted")
+
+    data = _parse_data()
+    try:
+        os.makedirs(os.path.dirname(snapshot_file) or ".", exist_ok=True)
+        with open(f"{snapshot_file}.tmp", "wb") as f:
+            pickle.dump({"key": key, "data": data}, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{snapshot_file}.tmp", snapshot_file)
+        logger.info("Saved data snapshot")
+    except OSError:
+        logger.exception("Failed to save data snapshot")
+    return data
+
+
+def _parse_data():
+    """Parses all the data files."""
+    groups_, aliases_, index = _groups()
+    states_ = _state_lists()
+    return (
+        groups_,
+        aliases_,
+        index,
+        states_,
+        _prompt(),
+        _memes(),
+        _all_lists(states_),
+        _wiki_urls(),
+    )
+
+
+(
+    groups,
+    aliases,
+    category_index,
+    states,
+    prompts,
+    meme_list,
+    master_id_list,
+    wikipedia_urls,
+) = _load_data()
 id_list = states[config.options["default_state_list"]]["list"]
 _config()
 
-all_categories = set(
-    tuple(groups.keys())
-    + tuple(
-        item for group in groups for item in config.options["category_aliases"][group]
-    )
-)  # includes category aliases
-possible_words = tuple(
-    itertools.chain(master_id_list, *aliases.values(), *prompts.values())
-)  # item list that includes item aliases and prompt values
+category_alias_index = {
+    **{
+        alias: group
+        for group in groups
+        for alias in config.options["category_aliases"][group]
+    },
+    **{group: group for group in groups},
+}  # category alias -> category
+
+# Derived structures that are expensive to build are created on first access
+# through the module __getattr__ below, so scripts and the web app that never
+# use them don't pay for them. `from sciolyid.data import all_categories`
+# works as usual.
+_lazy_attributes = {
+    # includes category aliases
+    "all_categories": lambda: set(category_alias_index.keys()),
+    # item list that includes item aliases and prompt values
+    "possible_words": lambda: tuple(
+        itertools.chain(master_id_list, *aliases.values(), *prompts.values())
+    ),
+    # for fast spellchecking
+    "possible_words_index": lambda: FuzzyMatcher(__getattr__("possible_words")),
+}
+
+
+def __getattr__(name: str):
+    if name in _lazy_attributes:
+        logger.info(f"building {name}")
+        value = _lazy_attributes[name]()
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 logger.info(f"List Lengths: {len(id_list)}")
 logger.info(f"Master List Lengths: {len(master_id_list)}")
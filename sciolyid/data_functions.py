@@ -3,29 +3,171 @@ import string
 
 from sciolyid.data import database, logger
 
+# Bookkeeping is batched so that each command costs as few round trips as
+# possible. Functions that increment values accept an optional `pipe`
+# argument; if a pipeline is passed, commands are queued on it and the caller
+# is responsible for executing it. Otherwise, the function executes its own
+# pipeline.
+#
+# Commands that depend on the existence of another key (sessions, races) use
+# small Lua scripts so they can still be queued in the same pipeline.
+
+# KEYS[1] - key that must exist, KEYS[2] - sorted set
+# ARGV[1] - score, ARGV[2] - member
+_zadd_nx_if_exists = database.register_script(
+    """
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        return redis.call('ZADD', KEYS[2], 'NX', ARGV[1], ARGV[2])
+    end
+    return false
+    """
+)
 
-async def channel_setup(ctx):
-    """Sets up a new discord channel.
+# KEYS[1] - key that must exist, KEYS[2] - sorted set
+# ARGV[1] - amount, ARGV[2] - member
+_zincrby_if_exists = database.register_script(
+    """
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        return redis.call('ZINCRBY', KEYS[2], ARGV[1], ARGV[2])
+    end
+    return false
+    """
+)
 
-    `ctx` - Discord context object
+# KEYS[1] - hash
+# ARGV[1] - field, ARGV[2] - amount
+_hincrby_if_exists = database.register_script(
     """
-    logger.info("checking channel setup")
-    if not database.exists(f"channel:{ctx.channel.id}"):
-        database.hset(
-            f"channel:{ctx.channel.id}",
-            mapping={"item": "", "answered": 1, "prevJ": 20, "prevI": ""},
-        )
-        # true = 1, false = 0, prevJ is 20 to define as integer
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        return redis.call('HINCRBY', KEYS[1], ARGV[1], ARGV[2])
+    end
+    return false
+    """
+)
+
+# KEYS[1] - current streak, KEYS[2] - max streak
+# ARGV[1] - amount, ARGV[2] - user id
+_streak_increment = database.register_script(
+    """
+    local streak = redis.call('ZINCRBY', KEYS[1], ARGV[1], ARGV[2])
+    redis.call('ZADD', KEYS[2], 'GT', streak, ARGV[2])
+    return streak
+    """
+)
+
+
+def _today() -> str:
+    return str(datetime.datetime.now(datetime.timezone.utc).date())
+
+
+def _queue_channel_setup(pipe, ctx) -> int:
+    """Queues channel setup commands on `pipe`.
+
+    The first result is truthy if the channel is new.
+    Returns the number of commands queued.
+    """
+    channel_key = f"channel:{ctx.channel.id}"
+    # true = 1, false = 0, prevJ is 20 to define as integer
+    pipe.hsetnx(channel_key, "item", "")
+    pipe.hsetnx(channel_key, "answered", 1)
+    pipe.hsetnx(channel_key, "prevJ", 20)
+    pipe.hsetnx(channel_key, "prevI", "")
+    pipe.zadd("score:global", {str(ctx.channel.id): 0}, nx=True)
+    queued = 5
+
+    if ctx.guild is not None:
+        channels = tuple(str(x.id) for x in ctx.guild.text_channels)
+        if channels:
+            pipe.sadd(f"channels:{ctx.guild.id}", *channels)
+            queued += 1
+    return queued
+
+
+def _queue_user_setup(pipe, ctx) -> int:
+    """Queues user setup commands on `pipe`.
+
+    The first result is truthy if the user is new. If in a guild,
+    the last result is truthy if the legacy server user key exists.
+    Returns the number of commands queued.
+    """
+    user_id = str(ctx.author.id)
+    pipe.zadd("users:global", {user_id: 0}, nx=True)
+    pipe.zadd(f"daily.score:{_today()}", {user_id: 0}, nx=True)
+    pipe.zadd("streak:global", {user_id: 0}, nx=True)
+    pipe.zadd("streak.max:global", {user_id: 0}, nx=True)
+    queued = 4
+
+    if ctx.guild is not None:
+        pipe.sadd(f"users.server.id:{ctx.guild.id}", user_id)
+        pipe.zadd(f"users.server.score:{ctx.guild.id}", {user_id: 0}, nx=True)
+        pipe.exists(f"users.server:{ctx.guild.id}")
+        queued += 3
+    return queued
+
+
+async def _channel_setup_results(ctx, results):
+    if results[0]:
         logger.info("channel data added")
         await ctx.send("Ok, setup! I'm all ready to use!")
 
-    if database.zscore("score:global", str(ctx.channel.id)) is None:
-        database.zadd("score:global", {str(ctx.channel.id): 0})
-        logger.info("channel score added")
 
-    if ctx.guild is not None:
-        channels = map(lambda x: str(x.id), ctx.guild.text_channels)
-        database.sadd(f"channels:{ctx.guild.id}", *channels)
+async def _user_setup_results(ctx, results):
+    if results[0]:
+        logger.info("user global added")
+        await ctx.send("Welcome <@" + str(ctx.author.id) + ">!")
+
+    if ctx.guild is not None and results[-1]:
+        # migrate users from the old sorted set format
+        users = [
+            user.decode("utf-8")
+            for user in await database.zrange(f"users.server:{ctx.guild.id}", 0, -1)
+        ]
+        scores = await database.zmscore("users:global", users)
+        pipe = database.pipeline()
+        pipe.sadd(f"users.server.id:{ctx.guild.id}", *users)
+        pipe.zadd(
+            f"users.server.score:{ctx.guild.id}",
+            {user: score or 0 for user, score in zip(users, scores)},
+            nx=True,
+        )
+        pipe.delete(f"users.server:{ctx.guild.id}")
+        await pipe.execute()
+        logger.info("migrated server users")
+
+
+async def migrate_server_scores():
+    """Builds the server leaderboards from the server user lists.
+
+    Server leaderboards used to be computed from the global scores of
+    the users in users.server.id:guild_id, so each server's sorted set
+    starts with those scores. This only runs once, which is recorded
+    in migrations:global.
+    """
+    if await database.sismember("migrations:global", "users.server.score"):
+        return
+
+    logger.info("migrating server leaderboards")
+    pipe = database.pipeline()
+    async for key in database.scan_iter(match="users.server.id:*", count=1000):
+        guild_id = key.decode("utf-8").split(":")[1]
+        # members of a set have a score of 1, so weight them by 0
+        pipe.zinterstore(f"users.server.score:{guild_id}", {"users:global": 1, key: 0})
+        if len(pipe) >= 500:
+            await pipe.execute()
+    pipe.sadd("migrations:global", "users.server.score")
+    await pipe.execute()
+    logger.info("migrated server leaderboards")
+
+
+async def channel_setup(ctx):
+    """Sets up a new discord channel.
+
+    `ctx` - Discord context object
+    """
+    logger.info("checking channel setup")
+    pipe = database.pipeline()
+    _queue_channel_setup(pipe, ctx)
+    await _channel_setup_results(ctx, await pipe.execute())
 
 
 async def user_setup(ctx):
@@ -34,192 +176,147 @@ async def user_setup(ctx):
     `ctx` - Discord context object
     """
     logger.info("checking user data")
-    if database.zscore("users:global", str(ctx.author.id)) is None:
-        database.zadd("users:global", {str(ctx.author.id): 0})
-        logger.info("user global added")
-        await ctx.send("Welcome <@" + str(ctx.author.id) + ">!")
+    pipe = database.pipeline()
+    _queue_user_setup(pipe, ctx)
+    await _user_setup_results(ctx, await pipe.execute())
 
-    date = str(datetime.datetime.now(datetime.timezone.utc).date())
-    if database.zscore(f"daily.score:{date}", str(ctx.author.id)) is None:
-        database.zadd(f"daily.score:{date}", {str(ctx.author.id): 0})
-        logger.info("user daily added")
 
-    # Add streak
-    if (database.zscore("streak:global", str(ctx.author.id)) is None) or (
-        database.zscore("streak.max:global", str(ctx.author.id)) is None
-    ):
-        database.zadd("streak:global", {str(ctx.author.id): 0})
-        database.zadd("streak.max:global", {str(ctx.author.id): 0})
-        logger.info("added streak")
+async def command_setup(ctx):
+    """Sets up the channel and user and logs command frequency.
 
-    if ctx.guild is not None:
-        if database.exists(f"users.server:{ctx.guild.id}"):
-            users = map(
-                lambda x: x.decode("utf-8"),
-                database.zrange(f"users.server:{ctx.guild.id}", 0, -1),
-            )
-            database.sadd(f"users.server.id:{ctx.guild.id}", *users)
-            database.delete(f"users.server:{ctx.guild.id}")
-        database.sadd(f"users.server.id:{ctx.guild.id}", str(ctx.author.id))
-        logger.info("synced user to server")
-
-
-def item_setup(ctx, item: str):
-    """Sets up a new item for incorrect tracking.
+    This is equivalent to running channel_setup() and user_setup()
+    but only uses one round trip to the database.
 
     `ctx` - Discord context object
-    `item` - item to setup
     """
-    logger.info("checking item data")
-    if database.zscore("incorrect:global", string.capwords(item)) is not None:
-        logger.info("item global ok")
-    else:
-        database.zadd("incorrect:global", {string.capwords(item): 0})
-        logger.info("item global added")
-
-    if (
-        database.zscore(f"incorrect.user:{ctx.author.id}", string.capwords(item))
-        is not None
-    ):
-        logger.info("incorrect item user ok")
-    else:
-        database.zadd(f"incorrect.user:{ctx.author.id}", {string.capwords(item): 0})
-        logger.info("incorrect item user added")
-
-    if (
-        database.zscore(f"correct.user:{ctx.author.id}", string.capwords(item))
-        is not None
-    ):
-        logger.info("correct item user ok")
-    else:
-        database.zadd(f"correct.user:{ctx.author.id}", {string.capwords(item): 0})
-        logger.info("correct item user added")
+    logger.info("checking channel and user setup")
+    pipe = database.pipeline()
+    pipe.zincrby("frequency.command:global", 1, str(ctx.command))
+    channel_count = _queue_channel_setup(pipe, ctx)
+    _queue_user_setup(pipe, ctx)
+    results = (await pipe.execute())[1:]
+    await _channel_setup_results(ctx, results[:channel_count])
+    await _user_setup_results(ctx, results[channel_count:])
 
-    date = str(datetime.datetime.now(datetime.timezone.utc).date())
-    if database.zscore(f"daily.incorrect:{date}", string.capwords(item)) is not None:
-        logger.info("item daily ok")
-    else:
-        database.zadd(f"daily.incorrect:{date}", {string.capwords(item): 0})
-        logger.info("item daily added")
 
-    if database.zscore("frequency.item:global", string.capwords(item)) is not None:
-        logger.info("item freq global ok")
-    else:
-        database.zadd("frequency.item:global", {string.capwords(item): 0})
-        logger.info("item freq global added")
+async def item_setup(ctx, item: str, pipe=None):
+    """Sets up a new item for incorrect tracking.
 
+    `ctx` - Discord context object
+    `item` - item to setup
+    `pipe` - optional pipeline to queue commands on
+    """
+    logger.info("checking item data")
+    execute = pipe is None
+    if execute:
+        pipe = database.pipeline()
+
+    item = string.capwords(item)
+    pipe.zadd("incorrect:global", {item: 0}, nx=True)
+    pipe.zadd(f"incorrect.user:{ctx.author.id}", {item: 0}, nx=True)
+    pipe.zadd(f"correct.user:{ctx.author.id}", {item: 0}, nx=True)
+    pipe.zadd(f"daily.incorrect:{_today()}", {item: 0}, nx=True)
+    pipe.zadd("frequency.item:global", {item: 0}, nx=True)
     if ctx.guild is not None:
-        logger.info("no dm")
-        if (
-            database.zscore(f"incorrect.server:{ctx.guild.id}", string.capwords(item))
-            is not None
-        ):
-            logger.info("item server ok")
-        else:
-            database.zadd(
-                f"incorrect.server:{ctx.guild.id}", {string.capwords(item): 0}
-            )
-            logger.info("item server added")
-    else:
-        logger.info("dm context")
-
-    if database.exists(f"session.data:{ctx.author.id}"):
-        logger.info("session in session")
-        if (
-            database.zscore(f"session.incorrect:{ctx.author.id}", string.capwords(item))
-            is not None
-        ):
-            logger.info("item session ok")
-        else:
-            database.zadd(
-                f"session.incorrect:{ctx.author.id}", {string.capwords(item): 0}
-            )
-            logger.info("item session added")
-    else:
-        logger.info("no session")
+        pipe.zadd(f"incorrect.server:{ctx.guild.id}", {item: 0}, nx=True)
+    await _zadd_nx_if_exists(
+        keys=[f"session.data:{ctx.author.id}", f"session.incorrect:{ctx.author.id}"],
+        args=[0, item],
+        client=pipe,
+    )
+
+    if execute:
+        await pipe.execute()
 
 
-def session_increment(ctx, item: str, amount: int = 1):
+async def session_increment(ctx, item: str, amount: int = 1, pipe=None):
     """Increments the value of a database hash field by `amount`.
 
     `ctx` - Discord context object\n
     `item` - hash field to increment (see data.py for details,
     possible values include correct, incorrect, total)\n
-    `amount` (int) - amount to increment by, usually 1
-    """
-    if database.exists(f"session.data:{ctx.author.id}"):
-        logger.info("session active")
-        logger.info(f"incrementing {item} by {amount}")
-        value = int(database.hget(f"session.data:{ctx.author.id}", item))
-        value += int(amount)
-        database.hset(f"session.data:{ctx.author.id}", item, str(value))
-    else:
-        logger.info("session not active")
+    `amount` (int) - amount to increment by, usually 1\n
+    `pipe` - optional pipeline to queue commands on
+    """
+    logger.info(f"incrementing session {item} by {amount}")
+    await _hincrby_if_exists(
+        keys=[f"session.data:{ctx.author.id}"],
+        args=[item, int(amount)],
+        client=database if pipe is None else pipe,
+    )
 
 
-def incorrect_increment(ctx, item: str, amount: int = 1):
+async def incorrect_increment(ctx, item: str, amount: int = 1, pipe=None):
     """Increments the value of an incorrect item by `amount`.
 
     `ctx` - Discord context object\n
     `item` - item that was incorrect\n
-    `amount` (int) - amount to increment by, usually 1
+    `amount` (int) - amount to increment by, usually 1\n
+    `pipe` - optional pipeline to queue commands on
     """
     logger.info(f"incrementing incorrect {item} by {amount}")
-    date = str(datetime.datetime.now(datetime.timezone.utc).date())
-    database.zincrby("incorrect:global", amount, string.capwords(item))
-    database.zincrby(f"incorrect.user:{ctx.author.id}", amount, string.capwords(item))
-    database.zincrby(f"daily.incorrect:{date}", amount, string.capwords(item))
+    execute = pipe is None
+    if execute:
+        pipe = database.pipeline()
+
+    item = string.capwords(item)
+    pipe.zincrby("incorrect:global", amount, item)
+    pipe.zincrby(f"incorrect.user:{ctx.author.id}", amount, item)
+    pipe.zincrby(f"daily.incorrect:{_today()}", amount, item)
     if ctx.guild is not None:
-        logger.info("no dm")
-        database.zincrby(
-            f"incorrect.server:{ctx.guild.id}", amount, string.capwords(item)
-        )
-    else:
-        logger.info("dm context")
-    if database.exists(f"session.data:{ctx.author.id}"):
-        logger.info("session in session")
-        database.zincrby(
-            f"session.incorrect:{ctx.author.id}", amount, string.capwords(item)
-        )
-    else:
-        logger.info("no session")
+        pipe.zincrby(f"incorrect.server:{ctx.guild.id}", amount, item)
+    await _zincrby_if_exists(
+        keys=[f"session.data:{ctx.author.id}", f"session.incorrect:{ctx.author.id}"],
+        args=[amount, item],
+        client=pipe,
+    )
+
+    if execute:
+        await pipe.execute()
 
 
-def score_increment(ctx, amount: int = 1):
+async def score_increment(ctx, amount: int = 1, pipe=None):
     """Increments the score of a user by `amount`.
 
     `ctx` - Discord context object\n
-    `amount` (int) - amount to increment by, usually 1
+    `amount` (int) - amount to increment by, usually 1\n
+    `pipe` - optional pipeline to queue commands on
     """
     logger.info(f"incrementing score by {amount}")
-    date = str(datetime.datetime.now(datetime.timezone.utc).date())
-    database.zincrby("score:global", amount, str(ctx.channel.id))
-    database.zincrby("users:global", amount, str(ctx.author.id))
-    database.zincrby(f"daily.score:{date}", amount, str(ctx.author.id))
-    if ctx.guild is not None and database.exists(f"race.data:{ctx.channel.id}"):
-        logger.info("race in session")
-        database.zincrby(f"race.scores:{ctx.channel.id}", amount, str(ctx.author.id))
-    else:
-        logger.info("dm context")
+    execute = pipe is None
+    if execute:
+        pipe = database.pipeline()
 
+    pipe.zincrby("score:global", amount, str(ctx.channel.id))
+    pipe.zincrby("users:global", amount, str(ctx.author.id))
+    pipe.zincrby(f"daily.score:{_today()}", amount, str(ctx.author.id))
+    if ctx.guild is not None:
+        pipe.zincrby(f"users.server.score:{ctx.guild.id}", amount, str(ctx.author.id))
+        await _zincrby_if_exists(
+            keys=[f"race.data:{ctx.channel.id}", f"race.scores:{ctx.channel.id}"],
+            args=[amount, str(ctx.author.id)],
+            client=pipe,
+        )
 
-def streak_increment(ctx, amount: int):
+    if execute:
+        await pipe.execute()
+
+
+async def streak_increment(ctx, amount: int, pipe=None):
     """Increments the streak of a user by `amount`.
 
     `ctx` - Discord context object\n
     `amount` (int) - amount to increment by, usually 1.
-    If amount is None, the streak is ended.
+    If amount is None, the streak is ended.\n
+    `pipe` - optional pipeline to queue commands on
     """
-
+    client = database if pipe is None else pipe
     if amount is not None:
         # increment streak and update max
-        database.zincrby("streak:global", amount, ctx.author.id)
-        if database.zscore("streak:global", ctx.author.id) > database.zscore(
-            "streak.max:global", ctx.author.id
-        ):
-            database.zadd(
-                "streak.max:global",
-                {ctx.author.id: database.zscore("streak:global", ctx.author.id)},
-            )
+        await _streak_increment(
+            keys=["streak:global", "streak.max:global"],
+            args=[amount, str(ctx.author.id)],
+            client=client,
+        )
     else:
-        database.zadd("streak:global", {ctx.author.id: 0})
+        await client.zadd("streak:global", {str(ctx.author.id): 0})
@@ -18,6 +18,8 @@ import asyncio
 import concurrent.futures
 import os
 import logging
+import time
+from typing import List, Optional, Set
 
 import filelock
 from git import Repo
@@ -26,34 +28,182 @@ import sciolyid.config as config
 
 download_logger = logging.getLogger(config.options["name"] + ".git_downloads")
 
+# don't fetch again if the last sync finished this recently (seconds)
+SYNC_INTERVAL = 30.0
 
-async def download_github(data, category, item):  # pylint: disable=unused-argument
+# git operations run one at a time in a shared thread
+_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=1, thread_name_prefix="git"
+)
+_current_sync: Optional[asyncio.Future] = None
+# monotonic time of the last sync, or None if the repo hasn't been synced yet
+_last_sync: Optional[float] = None
+# item directories that were requested and are waiting to be checked out
+_pending: Set[str] = set()
+
+
+async def download_github(data, category, item):
+    """Clones or syncs the image repo.
+
+    Only one sync runs at a time. If a sync is already running,
+    this waits for that sync to finish instead of starting another.
+
+    If an item is requested, its directory is checked out again in case it
+    was evicted, and the repo is only synced if it still doesn't exist.
+    If `sparse_checkout` is set, only the items in those lists are checked
+    out when cloning, and other items are checked out when requested.
+
+    Returns a list of item directories that changed,
+    or None if the repo was cloned.
+    """
+    global _current_sync
+    directory = None
+    if item is not None:
+        directory = f"{category}/{item.lower()}"
+        _pending.add(directory)
+
+    while True:
+        if _current_sync is None or _current_sync.done():
+            _current_sync = asyncio.ensure_future(_download(data))
+        else:
+            download_logger.info("sync already running, waiting")
+        # don't cancel the shared sync if one caller is cancelled
+        result = await asyncio.shield(_current_sync)
+        # wait for another round if the item was requested after the sync started
+        if directory is None or directory not in _pending:
+            return result
+
+
+async def _download(data) -> Optional[List[str]]:
+    global _last_sync
     download_logger.info("syncing github")
-    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-        loop = asyncio.get_event_loop()
-        try:
-            os.listdir(config.options["download_dir"])
-        except FileNotFoundError:
-            download_logger.info("doesn't exist, cloning")
-            await loop.run_in_executor(executor, _clone)
-            download_logger.info("done cloning")
+    loop = asyncio.get_running_loop()
+    try:
+        os.listdir(config.options["download_dir"])
+    except FileNotFoundError:
+        download_logger.info("doesn't exist, cloning")
+        directories = None
+        if config.options["sparse_checkout"]:
+            directories = _sparse_directories(data) | _pending
+        _pending.clear()
+        await loop.run_in_executor(_executor, _clone, directories)
+        _last_sync = time.monotonic()
+        download_logger.info("done cloning")
+        return None
+
+    checked_out = []
+    if _pending:
+        directories = set(_pending)
+        _pending.clear()
+        download_logger.info(f"checking out {len(directories)} directories")
+        missing = await loop.run_in_executor(_executor, _checkout, directories)
+        checked_out = [
+            f"{config.options['download_dir']}{path}/" for path in directories
+        ]
+        if not missing:
+            return checked_out
+        # the items might have been added since the last sync
+        download_logger.info(f"{len(missing)} directories not in repo")
+
+    if _last_sync is not None and time.monotonic() - _last_sync < SYNC_INTERVAL:
+        download_logger.info("synced recently, skipping")
+        return checked_out
+
+    download_logger.info("exists, syncing")
+    changed = await loop.run_in_executor(_executor, _sync)
+    _last_sync = time.monotonic()
+    download_logger.info(f"done syncing, {len(changed)} directories changed")
+    return sorted(set(changed).union(checked_out))
+
+
+def _sparse_directories(data) -> Set[str]:
+    """Returns the item directories in the lists in `sparse_checkout`."""
+    items = set()
+    for name in config.options["sparse_checkout"]:
+        if name.upper() in data.states:
+            items.update(data.states[name.upper()]["list"])
+        elif data.dealias_group(name.lower()) is not None:
+            items.update(data.groups[data.dealias_group(name.lower())])
         else:
-            download_logger.info("exists, syncing")
-            await loop.run_in_executor(executor, _sync)
-            download_logger.info("done syncing")
+            raise config.BotConfigError(
+                f"Unknown list or group '{name}' in sparse_checkout"
+            )
+    return {f"{data.get_category(item)}/{item}" for item in items}
 
 
-def _clone():
-    lock = filelock.FileLock(config.options["download_dir"].strip("/") + ".lock")
+def _clone(directories: Optional[Set[str]] = None):
+    lock = filelock.FileLock(config.options["download_dir"].rstrip("/") + ".lock")
     with lock:
-        Repo.clone_from(
+        if directories is None:
+            Repo.clone_from(
+                config.options["github_image_repo_url"],
+                config.options["download_dir"],
+                multi_options=["--depth=1"],
+            )
+            return
+        # only download files when they're checked out
+        downloads = Repo.clone_from(
             config.options["github_image_repo_url"],
             config.options["download_dir"],
-            multi_options=["--depth=1"],
+            multi_options=["--depth=1", "--filter=blob:none", "--sparse"],
+        )
+        downloads.git.sparse_checkout("set", *sorted(directories))
+
+
+def _checkout(directories: Set[str]) -> List[str]:
+    """Checks out item directories and returns the ones that aren't in the repo."""
+    downloads = Repo(config.options["download_dir"])
+    if config.options["sparse_checkout"]:
+        downloads.git.sparse_checkout("add", *sorted(directories))
+    in_repo = set(
+        downloads.git.ls_tree(
+            "-d", "--name-only", "HEAD", "--", *sorted(directories)
+        ).splitlines()
+    )
+    if in_repo:
+        # restore files that were deleted, like evicted items, but only in
+        # the requested directories so other evicted items stay evicted
+        downloads.git.checkout("HEAD", "--", *sorted(in_repo))
+    return sorted(directories - in_repo)
+
+
+def _changed_directories(diffs) -> Set[str]:
+    """Returns the item directories of the paths in a git diff."""
+    directories = set()
+    for diff in diffs:
+        for path in (diff.a_path, diff.b_path):
+            parts = path.split("/") if path else ()
+            if len(parts) >= 3:  # category/item/file
+                directories.add(f"{parts[0]}/{parts[1]}")
+    return directories
+
+
+def _item_directories() -> Set[str]:
+    """Returns the item directories that are on disk."""
+    root = config.options["download_dir"]
+    directories = set()
+    for category in os.listdir(root):
+        if category.startswith(".") or not os.path.isdir(root + category):
+            continue
+        directories.update(
+            f"{category}/{item}"
+            for item in os.listdir(root + category)
+            if os.path.isdir(f"{root}{category}/{item}")
         )
+    return directories
 
 
-def _sync():
+def _sync() -> List[str]:
     downloads = Repo(config.options["download_dir"])
-    downloads.remote("origin").fetch()
-    downloads.head.reset(working_tree=True)
+    old_commit = downloads.head.commit
+    downloads.remote("origin").fetch(depth=1)
+    new_commit = downloads.commit("FETCH_HEAD")
+    changed = _changed_directories(old_commit.diff(new_commit))
+    before = _item_directories()
+    # only files that differ are rewritten, and deleted files are restored
+    downloads.head.reset(new_commit, index=True, working_tree=True)
+    after = _item_directories()
+    # changes outside a sparse checkout aren't on disk, so they aren't indexed.
+    # the reset also restores evicted directories, so those are indexed again
+    changed = (changed & (before | after)) | (after - before)
+    return [f"{config.options['download_dir']}{path}/" for path in sorted(changed)]
@@ -15,34 +15,47 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import asyncio
+import collections
+import datetime
 import errno
+import functools
+import hashlib
 import itertools
 import os
 import pickle
-from typing import Iterable, Union
+import string
+import time
+from typing import Iterable, Optional, Tuple, Union
 
 import aiohttp
 import discord
 import redis
 import wikipedia
 from discord.ext import commands
+from discord.utils import escape_markdown as esc
 from sentry_sdk import capture_exception
 
 import sciolyid.config as config
 import sciolyid.data
+from sciolyid import backups
+from sciolyid.core import media_index, media_usage
 from sciolyid.data import (
     GenericError,
     all_categories,
     database,
     dealias_group,
-    get_category,
     groups,
     id_list,
     logger,
     states,
 )
 from sciolyid.data_functions import channel_setup
-from sciolyid.util import fetch_get_user
+from sciolyid.util import (
+    fetch_get_user,
+    fetch_get_users,
+    user_cache_info,
+    user_cached,
+)
 
 
 def check_state_role(ctx) -> list:
@@ -67,9 +80,51 @@ def check_state_role(ctx) -> list:
     return user_states
 
 
+async def format_users(ctx, user_ids: Iterable[int], bold: bool = True) -> dict:
+    """Formats users for leaderboards.
+
+    Members of the current server are mentioned, and users that
+    can't be found are marked as deleted. All users are looked up
+    at once. Returns a dict of user id -> formatted string.
+
+    `ctx` - Discord context object\n
+    `user_ids` - ids of users to format\n
+    `bold` (bool) - whether to bold the user names
+    """
+    logger.info("formatting users")
+    user_ids = tuple(map(int, user_ids))
+    style = "**" if bold else ""
+
+    members = {}
+    if ctx.guild is not None:
+        members = await fetch_get_users(user_ids, ctx=ctx, member=True)
+    users = await fetch_get_users(
+        (user_id for user_id in user_ids if members.get(user_id) is None), ctx=ctx
+    )
+
+    formatted = {}
+    for user_id in user_ids:
+        user = members.get(user_id)
+        if user is not None:
+            formatted[user_id] = (
+                f"{style}{esc(user.name)}#{user.discriminator}{style} ({user.mention})"
+            )
+        elif users[user_id] is not None:
+            user = users[user_id]
+            formatted[user_id] = f"{style}{esc(user.name)}#{user.discriminator}{style}"
+        else:
+            formatted[user_id] = f"{style}Deleted{style}"
+    return formatted
+
+
 async def send_leaderboard(
     ctx, title, page, database_key=None, data=None, items_per_page=10
 ):
+    """Sends a leaderboard from a Redis sorted set or a list.
+
+    `data` is a list of (name, score) tuples sorted from highest to lowest,
+    used instead of `database_key`.
+    """
     logger.info("building/sending leaderboard")
 
     if database_key is None and data is None:
@@ -81,7 +136,7 @@ async def send_leaderboard(
         page = 1
 
     entry_count = (
-        int(database.zcard(database_key)) if database_key is not None else data.count()
+        int(await database.zcard(database_key)) if database_key is not None else len(data)
     )
     page = (page * 10) - 10
 
@@ -96,12 +151,12 @@ async def send_leaderboard(
     leaderboard_list = (
         map(
             lambda x: (x[0].decode("utf-8"), x[1]),
-            database.zrevrangebyscore(
+            await database.zrevrangebyscore(
                 database_key, "+inf", "-inf", page, items_per_page, True
             ),
         )
         if database_key is not None
-        else data.iloc[page : page + items_per_page - 1].items()
+        else data[page : page + items_per_page]
     )
     embed = discord.Embed(type="rich", colour=discord.Color.blurple())
     embed.set_author(name=config.options["bot_signature"])
@@ -128,17 +183,28 @@ def build_id_list(
     if isinstance(state, str):
         state = state.split(" ")
 
-    id_choices = set()
-    group_args = set(
-        map(dealias_group, all_categories.intersection(set(map(str.lower, categories))))
+    group_args = frozenset(
+        map(dealias_group, all_categories.intersection(map(str.lower, categories)))
     )
-    state_args = set(states.keys()).intersection(set(map(str.upper, state)))
-    logger.info(f"group_args: {group_args}, state_args: {state_args}")
+    state_args = frozenset(states.keys() & set(map(str.upper, state)))
+    logger.info(f"group_args: {set(group_args)}, state_args: {set(state_args)}")
 
     if not config.options["id_groups"]:
         logger.info("no groups allowed")
-        group_args = set()
+        group_args = frozenset()
+
+    id_choices = _cached_id_list(group_args, state_args)
+    logger.info(f"id_choices length: {len(id_choices)}")
+    return id_choices
+
 
+@functools.lru_cache(maxsize=1024)
+def _cached_id_list(group_args: frozenset, state_args: frozenset) -> tuple:
+    """Computes the ID list for a normalized set of groups and states.
+
+    The lists are static once data is loaded, so each combination
+    is only computed once.
+    """
     if group_args:
         items_in_group = set(
             itertools.chain.from_iterable(groups.get(o, []) for o in group_args)
@@ -151,7 +217,7 @@ def build_id_list(
             )
             id_choices = items_in_group.intersection(items_in_state)
         else:
-            id_choices = items_in_group.intersection(set(id_list))
+            id_choices = items_in_group.intersection(id_list)
     elif state_args:
         id_choices = set(
             itertools.chain.from_iterable(states[state]["list"] for state in state_args)
@@ -159,36 +225,154 @@ def build_id_list(
     else:
         id_choices = id_list
 
-    logger.info(f"id_choices length: {len(id_choices)}")
     return tuple(id_choices)
 
 
-def backup_all():
-    """Backs up the database to a file.
+async def compact_daily():
+    """Combines old daily stats into monthly rollups.
+
+    Daily sorted sets older than `daily_retention_days` are added to
+    the rollup for their month and then deleted.
+    """
+    logger.info("Compacting daily stats")
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    cutoff = str(today - datetime.timedelta(config.options["daily_retention_days"]))
+    compacted = 0
+    for stat in ("score", "incorrect"):
+        keys = sorted(
+            [
+                key.decode("utf-8")
+                async for key in database.scan_iter(
+                    match=f"daily.{stat}:????-??-??", count=5000
+                )
+            ]
+        )
+        for key in keys:
+            date = key.split(":")[1]
+            if date >= cutoff:
+                break
+            rollup = f"rollup.{stat}:{date[:7]}"
+            # add and delete together so a day is never counted twice
+            pipe = database.pipeline(transaction=True)
+            pipe.zunionstore(rollup, [rollup, key])
+            pipe.delete(key)
+            await pipe.execute()
+            compacted += 1
+    logger.info(f"Compacted {compacted} daily keys")
+
+
+def _write_backup_batch(writer, digests, previous, full, batch):
+    """Writes new or changed keys in a batch to a backup archive.
+
+    `digests` is updated with digests of the values in the batch.
+    """
+    records = []
+    for key, ttl, value in batch:
+        digest = hashlib.blake2b(value, digest_size=16).digest()
+        digests[key] = digest
+        if full or previous.get(key) != digest:
+            records.append((key, ttl, value))
+    writer.write(records)
+
+
+def _backup_state_path() -> str:
+    return config.options["backups_dir"] + "backup_state.pickle"
+
+
+def save_backup_state(state: dict):
+    """Saves the state returned by `backup_all` once its archive is uploaded.
+
+    Incremental backups are based on the last saved state, so it should
+    only be saved after the archive it describes is stored safely.
+    """
+    state_path = _backup_state_path()
+    with open(state_path + ".tmp", "wb") as f:
+        pickle.dump(state, f)
+    os.replace(state_path + ".tmp", state_path)
+    logger.info(f"saved backup state for {state['last']}")
 
-    This function serializes all data in the REDIS database
-    into a file in the `backups` directory.
 
-    This function is run with a task every 6 hours and sends the files
+async def backup_all(incremental: Optional[bool] = None) -> Tuple[str, dict]:
+    """Backs up the database to an archive in the `backups` directory.
+
+    Keys are found with SCAN and dumped with pipelines in small batches,
+    so Redis is never blocked for long. Incremental backups only contain
+    the keys that changed or were deleted since the last backup, found by
+    comparing digests of the dumped values. Every key is still dumped, so
+    incremental backups only make the archive smaller, not the load on
+    Redis. By default, a full backup is made after every
+    `backup_full_every` backups.
+
+    This function is run with a task every hour and sends the files
     to a specified discord channel.
+
+    Returns the path to the archive directory and the new backup state,
+    which should be passed to `save_backup_state` after the archive is
+    uploaded.
     """
     logger.info("Starting Backup")
-    logger.info("Creating Dump")
-    keys = (key.decode("utf-8") for key in database.keys())
-    dump = ((database.dump(key), key) for key in keys)
-    logger.info("Finished Dump")
-    logger.info("Writing To File")
+    os.makedirs(config.options["backups_dir"], exist_ok=True)
     try:
-        os.mkdir(config.options["backups_dir"])
-        logger.info("Created backups directory")
-    except FileExistsError:
-        logger.info("Backups directory exists")
-    with open(config.options["backups_dir"] + "dump.dump", "wb") as f:
-        with open(config.options["backups_dir"] + "keys.txt", "w") as k:
-            for item, key in dump:
-                pickle.dump(item, f)
-                k.write(f"{key}\n")
-    logger.info("Backup Finished")
+        with open(_backup_state_path(), "rb") as f:
+            state = pickle.load(f)
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        state = None
+    if incremental is None:
+        incremental = (
+            state is not None
+            and state["since_full"] + 1 < config.options["backup_full_every"]
+        )
+    elif state is None:
+        incremental = False
+    previous = state["digests"] if incremental else {}
+
+    created = int(time.time())
+    name = datetime.datetime.fromtimestamp(created, datetime.timezone.utc).strftime(
+        f"%Y%m%dT%H%M%S-{'incremental' if incremental else 'full'}"
+    )
+    writer = backups.ArchiveWriter(
+        config.options["backups_dir"] + name,
+        "incremental" if incremental else "full",
+        created,
+        config.options["backup_chunk_size"],
+        state["last"] if incremental else None,
+    )
+
+    logger.info(f"Creating {writer.index['mode']} dump")
+    loop = asyncio.get_running_loop()
+    digests = {}
+    cursor = 0
+    while True:
+        cursor, keys = await database.scan(cursor, count=1000)
+        keys = [key for key in keys if key not in digests]  # scan can repeat keys
+        pipe = database.pipeline()
+        for key in keys:
+            pipe.dump(key)
+            pipe.pttl(key)
+        results = await pipe.execute()
+        batch = [
+            (key, ttl, value)
+            for key, value, ttl in zip(keys, results[::2], results[1::2])
+            if value is not None and ttl != -2  # deleted while backing up
+        ]
+        await loop.run_in_executor(
+            None, _write_backup_batch, writer, digests, previous, not incremental, batch
+        )
+        if cursor == 0:
+            break
+
+    index = await loop.run_in_executor(
+        None, writer.close, previous.keys() - digests.keys()
+    )
+    logger.info(
+        f"Backup Finished: {index['keys']} keys in {len(index['chunks'])} chunks"
+        + f", {len(index['deleted'])} deleted"
+    )
+    return writer.path, {
+        "digests": digests,
+        "last": index["name"],
+        "since_full": state["since_full"] + 1 if incremental else 0,
+    }
 
 
 async def fools(ctx):
@@ -210,36 +394,161 @@ async def fools(ctx):
     return True
 
 
-async def get_all_users(bot):
+async def _active_users() -> list:
+    """Returns ids of users who answered correctly recently, most recent first."""
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    pipe = database.pipeline()
+    for days in range(config.options["user_warmer_active_days"]):
+        pipe.zrevrangebyscore(
+            f"daily.score:{today - datetime.timedelta(days)}", "+inf", 1
+        )
+    return list(dict.fromkeys(map(int, itertools.chain(*await pipe.execute()))))
+
+
+async def user_warmer_progress() -> dict:
+    """Returns the progress of the current user cache warmer pass.
+
+    `total` is the number of users in the pass and `remaining` is the
+    number of users left. `warmed`, `cached`, and `missing` count users
+    that were fetched, already cached, or not found.
+    """
+    pipe = database.pipeline()
+    pipe.hgetall("user_warmer:global")
+    pipe.llen("user_warmer.queue:global")
+    stats, remaining = await pipe.execute()
+    progress = {
+        field: int(stats.get(field.encode(), 0))
+        for field in ("total", "warmed", "cached", "missing", "started", "updated")
+    }
+    progress["remaining"] = remaining
+    return progress
+
+
+async def warm_user_cache(bot):
+    """Fetches users into the user cache in the background.
+
+    Users that answered recently are fetched first, then the rest of
+    users:global from highest to lowest score. A pass stops once the
+    user cache is full, since fetching more users would evict the ones
+    warmed first. Only `user_warmer_rate` users are fetched per second,
+    leaving rate limit headroom for commands. Users left in the current
+    pass are stored in Redis and only removed after they are fetched,
+    so after a restart the pass continues instead of starting over.
+    """
+    if bot.intents.members:
+        logger.info("members are cached, skipping user cache")
+        return
+
     logger.info("Starting user cache")
-    user_ids = map(int, database.zrangebyscore("users:global", "-inf", "+inf"))
-    for user_id in user_ids:
-        await fetch_get_user(user_id, bot=bot, member=False)
+    semaphore = asyncio.Semaphore(config.options["user_warmer_concurrency"])
+    interval = 1 / config.options["user_warmer_rate"]
+    next_request = time.monotonic()
+    max_size = config.options["user_cache_size"]
+
+    async def warm(user_id: int):
+        nonlocal next_request
+        if user_cached(user_id):
+            return "cached"
+        async with semaphore:
+            now = time.monotonic()
+            next_request = max(next_request + interval, now)
+            await asyncio.sleep(next_request - now)
+            user = await fetch_get_user(user_id, bot=bot, member=False)
+        return "missing" if user is None else "warmed"
+
+    async def warm_batch(user_ids):
+        results = collections.Counter(await asyncio.gather(*map(warm, user_ids)))
+        pipe = database.pipeline()
+        for field in ("warmed", "cached", "missing"):
+            pipe.hincrby("user_warmer:global", field, results[field])
+        pipe.hset("user_warmer:global", "updated", int(time.time()))
+        await pipe.execute()
+
+    active = (await _active_users())[:max_size]
+    logger.info(f"warming {len(active)} active users")
+    for i in range(0, len(active), 100):
+        await warm_batch(active[i : i + 100])
+
+    if await database.exists("user_warmer.queue:global"):
+        logger.info("resuming user cache pass")
+    else:
+        logger.info("starting new user cache pass")
+        # only queue as many users as fit in the cache after the active users
+        active_ids = set(map(str, active))
+        user_ids = [
+            user_id
+            for user_id in await database.zrevrangebyscore(
+                "users:global", "+inf", "-inf", start=0, num=max_size
+            )
+            if user_id.decode("utf-8") not in active_ids
+        ][: max_size - len(active)]
+        pipe = database.pipeline()
+        pipe.delete("user_warmer:global")
+        for i in range(0, len(user_ids), 1000):
+            pipe.rpush("user_warmer.queue:global", *user_ids[i : i + 1000])
+        pipe.hset(
+            "user_warmer:global",
+            mapping={"total": len(user_ids), "started": int(time.time())},
+        )
+        await pipe.execute()
+
+    while True:
+        if user_cache_info().size >= max_size:
+            logger.info("user cache is full, ending pass")
+            await database.delete("user_warmer.queue:global")
+            break
+        user_ids = await database.lrange("user_warmer.queue:global", 0, 99)
+        if not user_ids:
+            break
+        await warm_batch(tuple(map(int, user_ids)))
+        await database.ltrim("user_warmer.queue:global", len(user_ids), -1)
+        logger.info(f"user cache progress: {await user_warmer_progress()}")
     logger.info("User cache finished")
 
 
 async def evict_images():
-    """Deletes images for items that have exceeded a certain frequency.
+    """Deletes the least recently used items if download_dir is too large.
 
-    This prevents images from being stale. If the item frequency has
-    been incremented more than `evict_threshold` (e.g. 10) times,
-    this function will delete the top `max_evict` (e.g. 3) items.
+    The size of download_dir is taken from the media index. If it's
+    larger than `evict_max_bytes`, items are evicted until it isn't.
+    Items being used in races and sessions are kept. Items that haven't
+    been used since the bot started are evicted first, starting with
+    the least frequently used.
     """
-    logger.info("Updating cached images")
-
-    for item in map(
-        lambda x: x.decode(),
-        database.zrevrangebyscore(
-            "frequency.item.refresh:global",
-            "+inf",
-            min=config.options["evict_threshold"],
-            start=0,
-            num=config.options["max_evict"],
-        ),
-    ):
-        database.zadd("frequency.item.refresh:global", {item: 0})
-        category = get_category(item)
-        await config.options["evict_func"](sciolyid.data, category, item.lower())
+    sizes = media_index.directory_sizes()
+    total = sum(sizes.values())
+    logger.info(f"media cache: {total} bytes, {media_usage.stats()}")
+    if total <= config.options["evict_max_bytes"]:
+        return
+
+    logger.info("Evicting cached images")
+    pinned = await media_usage.pinned()
+    frequency = {
+        item.decode("utf-8"): score
+        for item, score in await database.zrange(
+            "frequency.item:global", 0, -1, withscores=True
+        )
+    }
+
+    def usage(directory):
+        item = directory.rstrip("/").split("/")[-1]
+        return (
+            media_usage.last_used.get(directory, 0.0),
+            frequency.get(string.capwords(item), 0.0),
+        )
+
+    for directory in sorted(sizes.keys() - pinned, key=usage):
+        if total <= config.options["evict_max_bytes"]:
+            break
+        if not sizes[directory]:
+            continue
+        category, item = directory.rstrip("/").split("/")[-2:]
+        logger.info(f"evicting {category}/{item}")
+        await config.options["evict_func"](sciolyid.data, category, item)
+        media_index.discard(directory)
+        media_usage.record_eviction(directory, sizes[directory])
+        total -= sizes[directory]
+    logger.info(f"media cache: {total} bytes after eviction")
 
 
 class CustomCooldown:
@@ -374,7 +683,7 @@ async def handle_error(ctx, error):
     elif isinstance(error, commands.CommandInvokeError):
         if isinstance(error.original, redis.exceptions.ResponseError):
             capture_exception(error.original)
-            if database.exists(f"channel:{ctx.channel.id}"):
+            if await database.exists(f"channel:{ctx.channel.id}"):
                 await ctx.send(
                     "**An unexpected ResponseError has occurred.**\n"
                     + "*Please log this message in #support in the support server below, or try again.*\n"
@@ -0,0 +1,68 @@
+import json
+import statistics
+import subprocess
+import sys
+
+# usage: python -m sciolyid.scripts.benchmark_import [setup json file] [number of runs]
+# the json file contains the arguments passed to sciolyid.setup()
+setup_file = sys.argv[1] if len(sys.argv) > 1 else "setup.json"
+runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+extensions = (
+    "sciolyid.cogs.media",
+    "sciolyid.cogs.check",
+    "sciolyid.cogs.skip",
+    "sciolyid.cogs.hint",
+    "sciolyid.cogs.score",
+    "sciolyid.cogs.stats",
+    "sciolyid.cogs.sessions",
+    "sciolyid.cogs.race",
+    "sciolyid.cogs.meta",
+    "sciolyid.cogs.other",
+)
+
+# runs in a fresh interpreter each time so nothing is already imported
+_child = """
+import importlib, json, sys, time
+
+start = time.perf_counter()
+import sciolyid
+with open(sys.argv[1], "r") as f:
+    sciolyid.setup(json.load(f))
+timings = {"sciolyid": time.perf_counter() - start}
+
+start = time.perf_counter()
+import sciolyid.data
+timings["sciolyid.data"] = time.perf_counter() - start
+
+for extension in sys.argv[2:]:
+    start = time.perf_counter()
+    importlib.import_module(extension)
+    timings[extension] = time.perf_counter() - start
+
+heavy = [name for name in ("pandas", "numpy") if name in sys.modules]
+print(json.dumps({"timings": timings, "heavy": heavy, "modules": len(sys.modules)}))
+"""
+
+
+def _run():
+    output = subprocess.run(
+        (sys.executable, "-c", _child, setup_file, *extensions),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+results = [_run() for _ in range(runs)]
+print(f"{runs} runs, {results[-1]['modules']} modules loaded")
+print(f"heavy modules loaded: {', '.join(results[-1]['heavy']) or 'none'}")
+for name in results[0]["timings"]:
+    times = [result["timings"][name] for result in results]
+    print(
+        f"{name}: {statistics.median(times) * 1000:.2f} ms median, "
+        + f"{min(times) * 1000:.2f} ms min"
+    )
+totals = [sum(result["timings"].values()) for result in results]
+print(f"total: {statistics.median(totals) * 1000:.2f} ms median")
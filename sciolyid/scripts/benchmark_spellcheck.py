@@ -0,0 +1,90 @@
+import difflib
+import os
+import random
+import string
+import sys
+import timeit
+
+from sciolyid.util import FuzzyMatcher
+
+# usage: python -m sciolyid.scripts.benchmark_spellcheck [data folder] [number of guesses]
+data_folder = sys.argv[1].rstrip("/") if len(sys.argv) > 1 else "data"
+guess_count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+
+def _words():
+    """Reads words from the group lists, or generates words if there is no data."""
+    words = []
+    group_folder = f"{data_folder}/group"
+    if os.path.isdir(group_folder):
+        for filename in os.listdir(group_folder):
+            with open(f"{group_folder}/{filename}", "r") as f:
+                for line in f:
+                    words += [x.strip().lower() for x in line.split(",") if x.strip()]
+    if not words:
+        print(f"No lists found in {group_folder}, using generated words")
+        words = [
+            " ".join(
+                "".join(random.choices(string.ascii_lowercase, k=random.randint(3, 9)))
+                for _ in range(random.randint(1, 3))
+            )
+            for _ in range(3000)
+        ]
+    return words
+
+
+def _misspell(word):
+    """Randomly deletes, swaps, or replaces a character."""
+    if len(word) < 2:
+        return word
+    i = random.randrange(len(word) - 1)
+    option = random.randrange(3)
+    if option == 0:
+        return word[:i] + word[i + 1 :]
+    if option == 1:
+        return word[:i] + word[i + 1] + word[i] + word[i + 2 :]
+    return word[:i] + random.choice(string.ascii_lowercase) + word[i + 1 :]
+
+
+def _difflib_closest(word, words):
+    matches = difflib.get_close_matches(
+        word.lower(), map(str.lower, words), n=1, cutoff=(2 / 3)
+    )
+    return matches[0] if matches else None
+
+
+words = tuple(_words())
+guesses = (
+    [random.choice(words) for _ in range(guess_count // 2)]
+    + [_misspell(random.choice(words)) for _ in range(guess_count // 2)]
+    + ["hello there", "what is this", "lol"]
+)
+print(f"{len(words)} words, {len(guesses)} guesses")
+
+build_time = timeit.timeit(lambda: FuzzyMatcher(words), number=1)
+matcher = FuzzyMatcher(words)
+
+mismatches = [
+    guess
+    for guess in guesses
+    if matcher.closest(guess) != _difflib_closest(guess, words)
+]
+print(f"mismatched results: {len(mismatches)} {mismatches[:5]}")
+
+difflib_time = timeit.timeit(
+    lambda: [_difflib_closest(guess, words) for guess in guesses], number=1
+)
+uncached_time = timeit.timeit(
+    lambda: [matcher._closest(guess, matcher.cutoff) for guess in guesses], number=1
+)
+cached_time = timeit.timeit(
+    lambda: [matcher.closest(guess) for guess in guesses], number=1
+)
+
+print(f"index build: {build_time * 1000:.2f} ms")
+for name, total in (
+    ("difflib", difflib_time),
+    ("FuzzyMatcher", uncached_time),
+    ("FuzzyMatcher (cached)", cached_time),
+):
+    print(f"{name}: {total / len(guesses) * 1000:.4f} ms per guess")
@@ -1,17 +1,83 @@
+import json
 import os
 import pickle
 import sys
 
 import redis
 
+from sciolyid.backups import INDEX_FILE, deleted_keys, read_chunk, read_index
+
+# usage: python -m sciolyid.scripts.restore_backup [backups folder] [archive name]
+# incremental archives are restored after the archives they are based on,
+# which must be in the same folder. the latest archive is used by default.
 if os.getenv("LOCAL_REDIS") == "true":
     database = redis.Redis(host="localhost", port=6379, db=0)
 else:
     database = redis.from_url(os.getenv("REDIS_URL"))
 folder = sys.argv[1].rstrip("/") if len(sys.argv) > 1 else "backups"
+archive_name = sys.argv[2] if len(sys.argv) > 2 else None
+progress_file = f"{folder}/restore_progress.json"
+batch_size = 500
 
 
-def restore_all():
+def _load_progress():
+    try:
+        with open(progress_file, "r") as f:
+            return set(json.load(f))
+    except FileNotFoundError:
+        return set()
+
+
+def _save_progress(progress):
+    with open(progress_file + ".tmp", "w") as f:
+        json.dump(sorted(progress), f)
+    os.replace(progress_file + ".tmp", progress_file)
+
+
+def _restore_records(records):
+    pipe = database.pipeline(transaction=False)
+    for key, ttl, value in records:
+        pipe.restore(key, max(ttl, 0), value, replace=True)
+        if len(pipe) >= batch_size:
+            pipe.execute()
+    pipe.execute()
+
+
+def restore_archive(name, progress):
+    """Restores an archive, after restoring the archive it is based on.
+
+    Finished chunks are saved to the progress file, so an interrupted
+    restore skips them when it is run again.
+    """
+    path = f"{folder}/{name}"
+    index = read_index(path)
+    if index["base"] is not None:
+        restore_archive(index["base"], progress)
+
+    print(f"restoring {name} ({index['mode']}, {index['keys']} keys)")
+    for chunk in index["chunks"]:
+        step = f"{name}/{chunk['file']}"
+        if step in progress:
+            print(f"skipping {step}")
+            continue
+        print(f"restoring {step}")
+        _restore_records(read_chunk(path, chunk))
+        progress.add(step)
+        _save_progress(progress)
+
+    step = f"{name}/deleted"
+    if index["deleted"] and step not in progress:
+        print(f"deleting {len(index['deleted'])} keys")
+        pipe = database.pipeline(transaction=False)
+        for key in deleted_keys(index):
+            pipe.delete(key)
+        pipe.execute()
+        progress.add(step)
+        _save_progress(progress)
+
+
+def restore_legacy():
+    """Restores a backup made before backup archives."""
     print("reading dump")
     with open(f"{folder}/dump.dump", "rb") as f:
         with open(f"{folder}/keys.txt", "r") as k:
@@ -23,5 +89,24 @@ def restore_all():
     print("restore finished")
 
 
+def restore_all():
+    archives = sorted(
+        name
+        for name in os.listdir(folder)
+        if os.path.exists(f"{folder}/{name}/{INDEX_FILE}")
+    )
+    if not archives and os.path.exists(f"{folder}/dump.dump"):
+        restore_legacy()
+        return
+    if not archives:
+        print(f"no backups found in {folder}")
+        return
+
+    restore_archive(archive_name or archives[-1], _load_progress())
+    if os.path.exists(progress_file):
+        os.remove(progress_file)
+    print("restore finished")
+
+
 if __name__ == "__main__":
     restore_all()
@@ -15,26 +15,30 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import asyncio
-import concurrent.futures
 import os
+import shutil
 import sys
 from datetime import date, datetime, timedelta, timezone
 
 import discord
 from discord.ext import commands, tasks
+from sentry_sdk import capture_exception
 
 import sciolyid.config as config
-import sciolyid.data
+from sciolyid.backups import INDEX_FILE, split_large_files
+from sciolyid.core import download_media, image_pool, warmup
 from sciolyid.data import GenericError, database, logger
-from sciolyid.data_functions import user_setup, channel_setup
+from sciolyid.data_functions import command_setup
 from sciolyid.functions import (
     backup_all,
+    compact_daily,
     evict_images,
     fools,
-    get_all_users,
     handle_error,
+    save_backup_state,
+    warm_user_cache,
 )
-from sciolyid.util import prune_user_cache
+from sciolyid.util import user_cache_info
 
 
 class CustomBot(commands.Bot):
@@ -54,6 +58,10 @@ class CustomBot(commands.Bot):
                 await handler(message)
         await super().on_message(message)
 
+    async def close(self):
+        image_pool.shutdown()
+        await super().close()
+
     def add_message_handler(self, handler):
         self.on_message_handler.append(handler)
 
@@ -101,6 +109,8 @@ class CustomBot(commands.Bot):
 
                 raise GenericError(f"Failed to load extension {extension}.", 999) from e
 
+        await warmup()
+
 
 # Initialize bot
 intent: discord.Intents = discord.Intents.none()
@@ -141,7 +151,8 @@ async def on_ready():
     if config.options["evict_images"]:
         refresh_images.start()
     refresh_user_cache.start()
-    evict_user_cache.start()
+    if config.options["daily_retention_days"] is not None:
+        refresh_daily.start()
     if config.options["backups_channel"]:
         refresh_backup.start()
 
@@ -165,24 +176,24 @@ async def prechecks(ctx: commands.Context):
     ).predicate(ctx)
 
     logger.info("global check: checking banned")
-    if database.zscore("ignore:global", str(ctx.channel.id)) is not None:
+    pipe = database.pipeline()
+    pipe.zscore("ignore:global", str(ctx.channel.id))
+    pipe.zscore("banned:global", str(ctx.author.id))
+    ignored, banned = await pipe.execute()
+    if ignored is not None:
         if ctx.interaction is not None:
             await ctx.send(
                 "The owner of the server has disabled commands in this channel.",
                 ephemeral=True,
             )
         raise GenericError(code=192)
-    if database.zscore("banned:global", str(ctx.author.id)) is not None:
+    if banned is not None:
         if ctx.interaction is not None:
             await ctx.send("You cannot use this command!", ephemeral=True)
         raise GenericError(code=842)
 
-    logger.info("global check: logging command frequency")
-    database.zincrby("frequency.command:global", 1, str(ctx.command))
-
-    logger.info("global check: database setup")
-    await channel_setup(ctx)
-    await user_setup(ctx)
+    logger.info("global check: logging command frequency and database setup")
+    await command_setup(ctx)
 
     return True
 
@@ -199,7 +210,9 @@ if config.options["holidays"]:
 
         if ctx.command.name == "noholiday":
             return True
-        if ctx.guild and database.sismember("noholiday:global", str(ctx.guild.id)):
+        if ctx.guild and await database.sismember(
+            "noholiday:global", str(ctx.guild.id)
+        ):
             return True
 
         now = datetime.now(tz=timezone(-timedelta(hours=4))).date()
@@ -229,7 +242,7 @@ if config.options["refresh_images"]:
     async def update_images():
         """Updates the images."""
         logger.info("updating images")
-        await config.options["download_func"](sciolyid.data, None, None)
+        await download_media(None, None)
         logger.info("done updating images!")
 
 
@@ -237,8 +250,8 @@ if config.options["evict_images"]:
 
     @tasks.loop(minutes=config.options["evict_frequency"])
     async def refresh_images():
-        """Task to delete a random selection of cached images every hour."""
-        logger.info("TASK: Refreshing some cache items")
+        """Task to evict cached images when download_dir is too large."""
+        logger.info("TASK: Evicting cache items")
         await evict_images()
 
 
@@ -246,44 +259,84 @@ if config.options["evict_images"]:
 async def refresh_user_cache():
     """Task to update User cache to increase performance of commands."""
     logger.info("TASK: Updating User cache")
-    await get_all_users(bot)
-
-
-@tasks.loop(minutes=8.0)
-async def evict_user_cache():
-    """Task to remove keys from the User cache to ensure freshness."""
-    logger.info("TASK: Removing user keys")
-    prune_user_cache(10)
+    await warm_user_cache(bot)
+    logger.info(f"User cache: {user_cache_info()}")
+
+
+@tasks.loop(hours=24.0)
+async def refresh_daily():
+    """Task to combine old daily stats into monthly rollups."""
+    logger.info("TASK: Compacting daily stats")
+    await compact_daily()
+
+
+def _backup_messages(path: str) -> list:
+    """Groups the files in a backup archive into messages.
+
+    Files larger than `backup_upload_limit` bytes are split into parts
+    first. Each message has at most 10 files (discord's limit) and a
+    total size of at most `backup_upload_limit` bytes. The index is sent
+    last, so an archive is complete in the channel once its index is
+    there.
+    """
+    filenames = split_large_files(path, config.options["backup_upload_limit"])
+    messages = [[]]
+    size = 0
+    for filename in sorted(filenames, key=lambda f: (f == INDEX_FILE, f)):
+        file_size = os.path.getsize(os.path.join(path, filename))
+        if messages[-1] and (
+            len(messages[-1]) == 10
+            or size + file_size > config.options["backup_upload_limit"]
+        ):
+            messages.append([])
+            size = 0
+        messages[-1].append(filename)
+        size += file_size
+    return messages
 
 
 @tasks.loop(hours=1.0)
 async def refresh_backup():
     """Sends a copy of the database to a discord channel (BACKUPS_CHANNEL)."""
     logger.info("Refreshing backup")
-    try:
-        os.remove(config.options["backups_dir"] + "dump.dump")
-        logger.info("Cleared backup dump")
-    except FileNotFoundError:
-        logger.info("Already cleared backup dump")
-    try:
-        os.remove(config.options["backups_dir"] + "keys.txt")
-        logger.info("Cleared backup keys")
-    except FileNotFoundError:
-        logger.info("Already cleared backup keys")
-
-    event_loop = asyncio.get_event_loop()
-    with concurrent.futures.ThreadPoolExecutor(1) as executor:
-        await event_loop.run_in_executor(executor, backup_all)
-
-    logger.info("Sending backup files")
+    path, state = await backup_all()
     channel = bot.get_channel(config.options["backups_channel"])
-    with open(config.options["backups_dir"] + "dump.dump", "rb") as f:
-        await channel.send(file=discord.File(f, filename="dump"))
-    with open(config.options["backups_dir"] + "keys.txt", "r") as f:
-        await channel.send(file=discord.File(f, filename="keys.txt"))
+    try:
+        logger.info("Sending backup files")
+        name = os.path.basename(path)
+        loop = asyncio.get_running_loop()
+        for filenames in await loop.run_in_executor(None, _backup_messages, path):
+            files = [
+                discord.File(os.path.join(path, filename), filename=filename)
+                for filename in filenames
+            ]
+            try:
+                await channel.send(f"Backup `{name}`", files=files)
+            finally:
+                for file in files:
+                    file.close()
+    except discord.HTTPException as e:
+        # the state isn't saved, so the next backup doesn't build on this one
+        logger.info(f"Backup upload failed: {e}")
+        capture_exception(e)
+        if e.status == 413:
+            # this fails every time, so tell someone instead of only logging
+            try:
+                await channel.send(
+                    "**Backup files are too large to upload.**\n"
+                    + "*Lower `backup_upload_limit` to discord's upload limit.*"
+                )
+            except discord.HTTPException:
+                pass
+        return
+    finally:
+        shutil.rmtree(path)
+    save_backup_state(state)
     logger.info("Backup Files Sent!")
 
 
 # Actually run the bot
+# image workers are forked before the bot starts any threads
+image_pool.start()
 token = os.getenv(config.options["bot_token_env"])
 bot.run(token)
@@ -14,59 +14,91 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+import collections
 import difflib
 import functools
 import math
-import random
+import time
 from io import BytesIO
-from typing import Iterable, Optional
+from typing import Iterable, Optional, Union
 
 import discord
 from PIL import Image
 
+import sciolyid.config as config
 
-def cache(func=None):
-    """Cache decorator based on functools.lru_cache.
-    This does not have a max_size and does not evict items.
-    In addition, results are only cached by the first provided argument.
+
+CacheInfo = collections.namedtuple(
+    "CacheInfo", ["hits", "misses", "evictions", "max_size", "size"]
+)
+
+
+def cache(max_size: int = 128, ttl: Optional[float] = None):
+    """Async cache decorator with a max size and expiring entries.
+
+    Results are cached by the first provided argument. Once there are
+    more than `max_size` results, the least recently used results are
+    evicted. Results expire `ttl` seconds after they are cached, or
+    never if `ttl` is None. Concurrent calls with the same uncached
+    argument share a single call to the wrapped function.
     """
 
     def wrapper(func):
-        sentinel = object()
+        cache_ = collections.OrderedDict()  # key -> (expiry time, result)
+        pending = {}  # key -> task for the wrapped function
+        hits = misses = evictions = 0
 
-        cache_ = {}
-        hits = misses = 0
-        cache_get = cache_.get
-        cache_len = cache_.__len__
-
-        def _evict():
-            """Evicts a random item from the local cache."""
-            if len(cache_) > 0:
-                cache_.pop(random.choice(tuple(cache_)), 0)
+        def _store(key, task):
+            nonlocal evictions
+            pending.pop(key, None)
+            if task.cancelled() or task.exception() is not None:
+                return
+            expires = math.inf if ttl is None else time.monotonic() + ttl
+            cache_[key] = (expires, task.result())
+            cache_.move_to_end(key)
+            while len(cache_) > max_size:
+                cache_.popitem(last=False)
+                evictions += 1
 
         async def wrapped(*args, **kwds):
-            # Simple caching without ordering or size limit
             nonlocal hits, misses
-            key = hash(args[0])
-            result = cache_get(key, sentinel)
-            if result is not sentinel:
-                hits += 1
-                return result
+            key = args[0]
+            entry = cache_.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    hits += 1
+                    cache_.move_to_end(key)
+                    return entry[1]
+                del cache_[key]
+
             misses += 1
-            result = await func(*args, **kwds)
-            cache_[key] = result
-            return result
+            task = pending.get(key)
+            if task is None:
+                task = asyncio.ensure_future(func(*args, **kwds))
+                pending[key] = task
+                task.add_done_callback(functools.partial(_store, key))
+            # don't cancel the call for other waiters if this one is cancelled
+            return await asyncio.shield(task)
 
         def cache_info():
             """Report cache statistics"""
-            return functools._CacheInfo(hits, misses, None, cache_len())
+            return CacheInfo(hits, misses, evictions, max_size, len(cache_))
+
+        def cache_clear():
+            """Removes all cached results."""
+            cache_.clear()
+
+        def cache_contains(key):
+            """Returns whether an unexpired result is cached for `key`."""
+            entry = cache_.get(key)
+            return entry is not None and entry[0] > time.monotonic()
 
         wrapped.cache_info = cache_info
-        wrapped.evict = _evict
+        wrapped.cache_clear = cache_clear
+        wrapped.cache_contains = cache_contains
         return functools.update_wrapper(wrapped, func)
 
-    if func:
-        return wrapper(func)
     return wrapper
 
 
@@ -85,6 +117,37 @@ def black_and_white(input_image_path) -> BytesIO:
     return final_buffer
 
 
+def resize_image(
+    input_image_path, max_bytes: int, max_dimension: int, grayscale: bool = False
+) -> BytesIO:
+    """Returns a smaller JPEG version of an image.
+
+    The image is scaled down to fit within `max_dimension` pixels, then
+    compressed with lower quality and smaller dimensions until it is
+    smaller than `max_bytes`.
+
+    Output type is a file object (BytesIO).
+
+    `input_image_path` - path to image (string) or file object
+    """
+    with Image.open(input_image_path) as original_image:
+        image = original_image.convert("L" if grayscale else "RGB")
+    dimension = min(max_dimension, max(image.size))
+    while True:
+        resized = image.copy()
+        resized.thumbnail((dimension, dimension))
+        for quality in (85, 70, 55):
+            final_buffer = BytesIO()
+            resized.save(final_buffer, "jpeg", quality=quality, optimize=True)
+            if final_buffer.tell() < max_bytes:
+                final_buffer.seek(0)
+                return final_buffer
+        if dimension <= 128:
+            final_buffer.seek(0)
+            return final_buffer
+        dimension //= 2
+
+
 async def fetch_get_user(user_id: int, ctx=None, bot=None, member: bool = False):
     if (ctx is None and bot is None) or (ctx is not None and bot is not None):
         raise ValueError("Only one of ctx or bot must be passed")
@@ -102,7 +165,69 @@ async def fetch_get_user(user_id: int, ctx=None, bot=None, member: bool = False)
         return None
 
 
-@cache()
+async def fetch_get_users(
+    user_ids: Iterable[int],
+    ctx=None,
+    bot=None,
+    member: bool = False,
+    concurrency: int = 5,
+) -> dict:
+    """Looks up multiple users at once.
+
+    Users that are cached are resolved locally. The rest are fetched
+    concurrently, with at most `concurrency` requests at a time.
+    Members are requested in chunks with guild member queries.
+
+    Returns a dict of user id -> user, or None if the user wasn't found.
+    """
+    if (ctx is None and bot is None) or (ctx is not None and bot is not None):
+        raise ValueError("Only one of ctx or bot must be passed")
+    if ctx:
+        bot = ctx.bot
+    elif member:
+        raise ValueError("ctx must be passed for member lookup")
+    user_ids = list(dict.fromkeys(user_ids))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    if not member:
+
+        async def fetch_user(user_id: int):
+            async with semaphore:
+                return await _fetch_cached_user(user_id, bot)
+
+        users = await asyncio.gather(*map(fetch_user, user_ids))
+        return dict(zip(user_ids, users))
+
+    members = {user_id: ctx.guild.get_member(user_id) for user_id in user_ids}
+    if bot.intents.members:
+        return members
+    missing = [user_id for user_id, user in members.items() if user is None]
+
+    async def query_members(chunk: list):
+        async with semaphore:
+            try:
+                return await ctx.guild.query_members(
+                    user_ids=chunk, limit=len(chunk), cache=False
+                )
+            except (asyncio.TimeoutError, discord.ClientException):
+                return await asyncio.gather(*map(fetch_member, chunk))
+
+    async def fetch_member(user_id: int):
+        try:
+            return await ctx.guild.fetch_member(user_id)
+        except discord.HTTPException:
+            return None
+
+    # guild member queries are limited to 100 users
+    chunks = [missing[i : i + 100] for i in range(0, len(missing), 100)]
+    for found in await asyncio.gather(*map(query_members, chunks)):
+        members.update((user.id, user) for user in found if user is not None)
+    return members
+
+
+@cache(
+    max_size=config.options["user_cache_size"], ttl=config.options["user_cache_ttl"]
+)
 async def _fetch_cached_user(user_id: int, bot):
     if bot.intents.members:
         return bot.get_user(user_id)
@@ -112,10 +237,14 @@ async def _fetch_cached_user(user_id: int, bot):
         return None
 
 
-def prune_user_cache(count: int = 5):
-    """Evicts `count` items from the user cache."""
-    for _ in range(count):
-        _fetch_cached_user.evict()
+def user_cache_info() -> CacheInfo:
+    """Returns statistics for the user cache."""
+    return _fetch_cached_user.cache_info()
+
+
+def user_cached(user_id: int) -> bool:
+    """Returns whether a user is in the user cache."""
+    return _fetch_cached_user.cache_contains(user_id)
 
 
 def spellcheck_list(
@@ -149,15 +278,125 @@ def spellcheck(worda: str, wordb: str, cutoff: int = 3) -> bool:
     return True
 
 
+class FuzzyMatcher:
+    """Finds the closest match to a word from a fixed list of words.
+
+    Results are the same as `difflib.get_close_matches(word, words, n=1)`,
+    but words are indexed by length and character counts when the matcher
+    is built. Candidates are visited from the closest length outwards and
+    skipped once their upper bound on the similarity ratio is lower than
+    the best match found so far, so only a few full comparisons are made.
+    Recent lookups are cached.
+
+    `might_match()` is a cheaper check that only uses the index, for
+    rejecting text that can't possibly match before calling `closest()`.
+    """
+
+    def __init__(self, words: Iterable[str], cutoff: float = (2 / 3)):
+        self.cutoff = cutoff
+        self.words = frozenset(map(str.lower, words))
+        by_length = collections.defaultdict(list)
+        # highest count of each character in words of each length
+        max_counts = collections.defaultdict(collections.Counter)
+        for word in self.words:
+            counts = collections.Counter(word)
+            by_length[len(word)].append((word, counts))
+            max_counts[len(word)] |= counts
+        self._by_length = dict(by_length)
+        self._max_counts = dict(max_counts)
+        self._cached_closest = functools.lru_cache(maxsize=4096)(self._closest)
+
+    def __contains__(self, word: str) -> bool:
+        return word.lower() in self.words
+
+    def closest(self, word: str, cutoff: Optional[float] = None) -> Optional[str]:
+        """Returns the closest word with a similarity ratio of at least `cutoff`.
+
+        Returns None if there are no close enough matches.
+        """
+        return self._cached_closest(
+            word.lower(), self.cutoff if cutoff is None else cutoff
+        )
+
+    def might_match(self, word: str, cutoff: Optional[float] = None) -> bool:
+        """Returns False if no word can have a similarity ratio of at least `cutoff`.
+
+        This only compares lengths and character counts against each group
+        of words, so it's much faster than `closest()` for text that isn't
+        close to anything, like long messages. A True result doesn't mean
+        that there is a match.
+        """
+        word = word.lower()
+        if word in self.words:
+            return True
+        cutoff = self.cutoff if cutoff is None else cutoff
+        word_len = len(word)
+        word_counts = collections.Counter(word)
+        for length, max_counts in self._max_counts.items():
+            total = word_len + length
+            if total == 0 or 2.0 * min(word_len, length) / total < cutoff:
+                continue
+            shared = sum(
+                min(count, max_counts[char]) for char, count in word_counts.items()
+            )
+            if 2.0 * shared / total >= cutoff:
+                return True
+        return False
+
+    def _closest(self, word: str, cutoff: float) -> Optional[str]:
+        if word in self.words:
+            return word  # an exact match always has the highest ratio
+
+        word_len = len(word)
+        word_counts = collections.Counter(word)
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(word)
+        best_score = cutoff
+        best_word = None
+
+        # the ratio can't be higher than 2 * min(a, b) / (a + b), so check
+        # lengths closest to the word's length first
+        lengths = sorted(
+            (
+                (2.0 * min(word_len, length) / (word_len + length), length)
+                for length in self._by_length
+                if word_len + length > 0
+            ),
+            reverse=True,
+        )
+        for length_bound, length in lengths:
+            if length_bound < best_score:
+                break
+            for candidate, counts in self._by_length[length]:
+                # the ratio can't be higher than the shared character count
+                shared = sum(
+                    min(count, counts[char]) for char, count in word_counts.items()
+                )
+                if 2.0 * shared / (word_len + length) < best_score:
+                    continue
+                matcher.set_seq1(candidate)
+                score = matcher.ratio()
+                if score > best_score or (
+                    score == best_score
+                    and (best_word is None or candidate > best_word)
+                ):
+                    best_score = score
+                    best_word = candidate
+        return best_word
+
+
 def better_spellcheck(
-    word: str, correct: Iterable[str], options: Iterable[str]
+    word: str, correct: Iterable[str], options: Union[FuzzyMatcher, Iterable[str]]
 ) -> bool:
-    """Allow lenient spelling unless another answer is closer."""
-    matches = difflib.get_close_matches(
-        word.lower(), map(str.lower, options), n=1, cutoff=(2 / 3)
-    )
-    if not matches:
+    """Allow lenient spelling unless another answer is closer.
+
+    `options` should be a prebuilt FuzzyMatcher for repeated checks.
+    """
+    if not isinstance(options, FuzzyMatcher):
+        options = FuzzyMatcher(options)
+    match = options.closest(word, cutoff=(2 / 3))
+    if match is None:
         return False
-    if matches[0] in map(str.lower, correct):
+    if match in map(str.lower, correct):
         return True
     return False
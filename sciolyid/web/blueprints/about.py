@@ -19,7 +19,7 @@ from operator import itemgetter
 from flask import Blueprint, jsonify
 
 import sciolyid.config as config
-from sciolyid.data import get_category, groups, master_id_list
+from sciolyid.data import category_index, groups, master_id_list
 from sciolyid.web.config import logger
 from sciolyid.web.functions.images import generate_id_lookup
 
@@ -76,7 +76,7 @@ def count():
             logger.info("too many subfolders!")
     for item in id_items:
         if config.options["id_groups"]:
-            category = get_category(item)
+            category = category_index.get(item)
             counts.setdefault(category, {})
             counts[category][item] = 0
         else:
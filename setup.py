@@ -28,13 +28,12 @@ setuptools.setup(
     packages=setuptools.find_packages(),
     install_requires=[
         "discord.py>=2.3.1, <3.0.0",
-        "redis>=3.3.5, <5.0.0",
+        "redis>=4.2.0, <5.0.0",
         "sentry-sdk>=1.1.0, <2.0.0",
         "Pillow>=9.0.1, <11.0.0",
         "wikipedia>=1.4.0, <2.0.0",
         "gitpython>=3.0.6, <4.0.0",
         "hiredis>=1.0.1, <3.0.0",
-        "pandas>=1.3.0, <3.0.0",
         "filelock>=3.4.2, <3.7.0",
     ],
     extras_require={